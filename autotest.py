@@ -5,10 +5,13 @@
 from argparse import (ArgumentParser, ArgumentDefaultsHelpFormatter, Namespace,
                       FileType, ArgumentTypeError)
 from argcomplete import autocomplete
-from configparser import ConfigParser
+from configparser import ConfigParser, SectionProxy
 from logging import (info, debug, error, warning,
                      DEBUG, INFO, WARN, ERROR)
+from logging.handlers import QueueHandler, QueueListener
 from colorlog import ColoredFormatter, StreamHandler, getLogger
+from queue import Queue
+from atexit import register as register_exit
 from sys import argv, stderr, modules
 from time import sleep
 from os import (access, R_OK, W_OK)
@@ -18,7 +21,7 @@ from code import InteractiveConsole
 
 
 # project imports
-from server import Server, Host, Guest, LoadGen
+from server import Server, Host, Guest, LoadGen, close_ssh_master
 from loadlatency import Machine, Interface, Reflector, LoadLatencyTestGenerator
 
 
@@ -232,16 +235,22 @@ def setup_parser() -> ArgumentParser:
                                   )
     run_guest_parser.add_argument('-r', '--rx-queue-size',
                                   type=int,
-                                  default=256,
+                                  default=512,
                                   help='''The size of the receive queue for
                                   the test interface.'''
                                   )
     run_guest_parser.add_argument('-t', '--tx-queue-size',
                                   type=int,
-                                  default=256,
+                                  default=512,
                                   help='''The size of the transmit queue for
                                   the test interface.'''
                                   )
+    run_guest_parser.add_argument('-b', '--blk-queue-size',
+                                  type=int,
+                                  default=128,
+                                  help='''The size of the queue of the root
+                                  disk.'''
+                                  )
     run_guest_parser.add_argument('-q',
                                   '--qemu-path',
                                   type=str,
@@ -561,9 +570,17 @@ def setup_logging(args: Namespace) -> None:
     )
     handler = StreamHandler()
     handler.setFormatter(formatter)
+
+    # Records are only put into a queue by the logging threads. A listener
+    # thread formats and writes them, so worker threads never block on the
+    # terminal.
+    log_queue = Queue()
+    listener = QueueListener(log_queue, handler)
     logger = getLogger()
-    logger.addHandler(handler)
+    logger.addHandler(QueueHandler(log_queue))
     logger.setLevel(LOG_LEVELS[args.verbosity])
+    listener.start()
+    register_exit(listener.stop)
 
 
 def create_servers(conf: ConfigParser,
@@ -603,44 +620,44 @@ def create_servers(conf: ConfigParser,
     servers = {}
     if host:
         servers['host'] = Host(
-            conf['host']['fqdn'],
-            conf['host']['admin_bridge'],
-            conf['host']['admin_bridge_ip_net'],
-            conf['host']['admin_tap'],
-            conf['host']['test_iface'],
-            conf['host']['test_iface_addr'],
-            conf['host']['test_iface_mac'],
-            conf['host']['test_iface_driv'],
-            conf['host']['test_bridge'],
-            conf['host']['test_tap'],
-            conf['host']['test_macvtap'],
-            conf['host']['root_disk_file'],
-            conf['guest']['admin_iface_mac'],
-            conf['guest']['test_iface_mac'],
-            conf['host']['moongen_dir'],
-            conf['host']['moonprogs_dir'],
-            conf['host']['xdp_reflector_dir']
+            fqdn=conf['host']['fqdn'],
+            admin_bridge=conf['host']['admin_bridge'],
+            admin_bridge_ip_net=conf['host']['admin_bridge_ip_net'],
+            admin_tap=conf['host']['admin_tap'],
+            test_iface=conf['host']['test_iface'],
+            test_iface_addr=conf['host']['test_iface_addr'],
+            test_iface_mac=conf['host']['test_iface_mac'],
+            test_iface_driv=conf['host']['test_iface_driv'],
+            test_bridge=conf['host']['test_bridge'],
+            test_tap=conf['host']['test_tap'],
+            test_macvtap=conf['host']['test_macvtap'],
+            guest_root_disk_path=conf['host']['root_disk_file'],
+            guest_admin_iface_mac=conf['guest']['admin_iface_mac'],
+            guest_test_iface_mac=conf['guest']['test_iface_mac'],
+            moongen_dir=conf['host']['moongen_dir'],
+            moonprogs_dir=conf['host']['moonprogs_dir'],
+            xdp_reflector_dir=conf['host']['xdp_reflector_dir']
         )
     if guest:
         servers['guest'] = Guest(
-            conf['guest']['fqdn'],
-            conf['guest']['test_iface'],
-            conf['guest']['test_iface_addr'],
-            conf['guest']['test_iface_mac'],
-            conf['guest']['test_iface_driv'],
-            conf['guest']['moongen_dir'],
-            conf['guest']['moonprogs_dir'],
-            conf['guest']['xdp_reflector_dir']
+            fqdn=conf['guest']['fqdn'],
+            test_iface=conf['guest']['test_iface'],
+            test_iface_addr=conf['guest']['test_iface_addr'],
+            test_iface_mac=conf['guest']['test_iface_mac'],
+            test_iface_driv=conf['guest']['test_iface_driv'],
+            moongen_dir=conf['guest']['moongen_dir'],
+            moonprogs_dir=conf['guest']['moonprogs_dir'],
+            xdp_reflector_dir=conf['guest']['xdp_reflector_dir']
         )
     if loadgen:
         servers['loadgen'] = LoadGen(
-            conf['loadgen']['fqdn'],
-            conf['loadgen']['test_iface'],
-            conf['loadgen']['test_iface_addr'],
-            conf['loadgen']['test_iface_mac'],
-            conf['loadgen']['test_iface_driv'],
-            conf['loadgen']['moongen_dir'],
-            conf['loadgen']['moonprogs_dir']
+            fqdn=conf['loadgen']['fqdn'],
+            test_iface=conf['loadgen']['test_iface'],
+            test_iface_addr=conf['loadgen']['test_iface_addr'],
+            test_iface_mac=conf['loadgen']['test_iface_mac'],
+            test_iface_driv=conf['loadgen']['test_iface_driv'],
+            moongen_dir=conf['loadgen']['moongen_dir'],
+            moonprogs_dir=conf['loadgen']['moonprogs_dir']
         )
     return servers
 
@@ -714,9 +731,12 @@ def run_guest(args: Namespace, conf: ConfigParser) -> None:
 
         host.run_guest(args.interface, args.machine, disk, args.debug,
                        args.ioregionfd, args.qemu_path, args.vhost,
-                       args.rx_queue_size, args.tx_queue_size)
+                       args.rx_queue_size, args.tx_queue_size,
+                       blk_queue_size=args.blk_queue_size)
     except Exception:
         host.kill_guest()
+        # no Guest object, creating it would try to connect to the guest
+        close_ssh_master(conf['guest']['fqdn'])
         host.cleanup_network()
 
 
@@ -747,6 +767,8 @@ def kill_guest(args: Namespace, conf: ConfigParser) -> None:
     host: Host = create_servers(conf, guest=False, loadgen=False)['host']
 
     host.kill_guest()
+    # no Guest object, creating it would try to connect to the guest
+    close_ssh_master(conf['guest']['fqdn'])
     host.cleanup_network()
 
 
@@ -1132,7 +1154,7 @@ def test_load_latency(
 
     # clean up guest and network first
     try:
-        host.kill_guest()
+        host.kill_guest(guest)
     except Exception:
         pass
     host.cleanup_network()
@@ -1231,7 +1253,7 @@ def test_load_latency(
 
         # teardown interface
         if interface in ['brtap', 'macvtap']:
-            host.kill_guest()
+            host.kill_guest(guest)
         host.cleanup_network()
 
     # accumulate the histogram of multiple repetitions here
@@ -1239,6 +1261,50 @@ def test_load_latency(
         accumulate_all_histograms(outdir, reflector, tests_todo)
 
 
+def create_load_latency_generator(tconf: SectionProxy
+                                  ) -> LoadLatencyTestGenerator:
+    """
+    Create a load latency test generator from a test config section.
+
+    Parameters
+    ----------
+    tconf : SectionProxy
+        The test config section defining the tests.
+
+    Returns
+    -------
+    LoadLatencyTestGenerator
+        The load latency test generator.
+
+    See Also
+    --------
+    test_load_lat_file : Run the load latency tests of a test config file.
+    acc_load_lat_file : Accumulate the load latency tests of a test config
+        file.
+
+    Example
+    -------
+    >>> create_load_latency_generator(test_conf['virtio'])
+    LoadLatencyTestGenerator(...)
+    """
+    return LoadLatencyTestGenerator(
+        {Machine(m.strip()) for m in tconf['machines'].split(',')},
+        {Interface(i.strip()) for i in tconf['interfaces'].split(',')},
+        {q.strip() for q in tconf['qemus'].split(',')},
+        {v.strip() == 'true' for v in tconf['vhosts'].split(',')},
+        {io.strip() == 'true' for io in tconf['ioregionfds'].split(',')},
+        {Reflector(rf.strip()) for rf in tconf['reflectors'].split(',')},
+        {int(ra.strip()) for ra in tconf['rates'].split(',')},
+        int(tconf['size']),
+        {int(rt.strip()) for rt in tconf['runtimes'].split(',')},
+        int(tconf['repetitions']),
+        tconf['warmup'] == 'true',
+        tconf['cooldown'] == 'true',
+        tconf['accumulate'] == 'true',
+        tconf['outputdir']
+    )
+
+
 def test_load_lat_file(args: Namespace, conf: ConfigParser) -> None:
     """
     Run the load latency tests defined in a test config file.
@@ -1260,41 +1326,24 @@ def test_load_lat_file(args: Namespace, conf: ConfigParser) -> None:
     loadgen: LoadGen
     host, guest, loadgen = create_servers(conf).values()
 
-    test_conf = ConfigParser()
-    for testconfig in args.testconfigs:
-        test_conf_path = testconfig.name if hasattr(testconfig, 'name') \
-            else testconfig
-        test_conf.read(test_conf_path)
+    with host, guest, loadgen:
+        test_conf = ConfigParser()
+        for testconfig in args.testconfigs:
+            test_conf_path = testconfig.name if hasattr(testconfig, 'name') \
+                else testconfig
+            test_conf.read(test_conf_path)
 
-        info(f'Running tests from {test_conf_path}')
+            info(f'Running tests from {test_conf_path}')
 
-        for section in test_conf.sections():
-            info(f'Running tests from section {section}')
-
-            tconf = test_conf[section]
-            generator = LoadLatencyTestGenerator(
-                {Machine(m.strip()) for m in tconf['machines'].split(',')},
-                {Interface(i.strip()) for i in tconf['interfaces'].split(',')},
-                {q.strip() for q in tconf['qemus'].split(',')},
-                {v.strip() == 'true' for v in tconf['vhosts'].split(',')},
-                {io.strip() == 'true'
-                 for io in tconf['ioregionfds'].split(',')},
-                {Reflector(rf.strip())
-                 for rf in tconf['reflectors'].split(',')},
-                {int(ra.strip()) for ra in tconf['rates'].split(',')},
-                int(tconf['size']),
-                {int(rt.strip()) for rt in tconf['runtimes'].split(',')},
-                int(tconf['repetitions']),
-                tconf['warmup'] == 'true',
-                tconf['cooldown'] == 'true',
-                tconf['accumulate'] == 'true',
-                tconf['outputdir']
-            )
-            generator.generate(host)
-            if args.dry_run:
-                info('Dry run, not running tests.')
-            else:
-                generator.run(host, guest, loadgen)
+            for section in test_conf.sections():
+                info(f'Running tests from section {section}')
+
+                generator = create_load_latency_generator(test_conf[section])
+                generator.generate(host)
+                if args.dry_run:
+                    info('Dry run, not running tests.')
+                else:
+                    generator.run(host, guest, loadgen)
 
 
 def acc_load_lat_file(args: Namespace, conf: ConfigParser) -> None:
@@ -1314,25 +1363,7 @@ def acc_load_lat_file(args: Namespace, conf: ConfigParser) -> None:
         for section in test_conf.sections():
             info(f'Accumulating tests from section {section}')
 
-            tconf = test_conf[section]
-            generator = LoadLatencyTestGenerator(
-                {Machine(m.strip()) for m in tconf['machines'].split(',')},
-                {Interface(i.strip()) for i in tconf['interfaces'].split(',')},
-                {q.strip() for q in tconf['qemus'].split(',')},
-                {v.strip() == 'true' for v in tconf['vhosts'].split(',')},
-                {io.strip() == 'true'
-                 for io in tconf['ioregionfds'].split(',')},
-                {Reflector(rf.strip())
-                 for rf in tconf['reflectors'].split(',')},
-                {int(ra.strip()) for ra in tconf['rates'].split(',')},
-                int(tconf['size']),
-                {int(rt.strip()) for rt in tconf['runtimes'].split(',')},
-                int(tconf['repetitions']),
-                tconf['warmup'] == 'true',
-                tconf['cooldown'] == 'true',
-                tconf['accumulate'] == 'true',
-                tconf['outputdir']
-            )
+            generator = create_load_latency_generator(test_conf[section])
             generator.generate(host)
             generator.force_accumulate()
 
@@ -1,11 +1,14 @@
 from dataclasses import dataclass, field
 from enum import Enum
 from logging import error, info, debug
+from concurrent.futures import ThreadPoolExecutor, Future
 from time import sleep
-from os.path import isfile, join as path_join
-from copy import deepcopy
+from datetime import timedelta
+from os import listdir
+from os.path import isdir, isfile, join as path_join
+from itertools import chain, groupby, product
 
-from server import Server, Host, Guest, LoadGen
+from server import Server, Host, Guest, LoadGen, parallel
 
 
 class Machine(Enum):
@@ -46,7 +49,7 @@ class Reflector(Enum):
     XDP = "xdp"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class LoadLatencyTest(object):
     """
     Load latency test class
@@ -66,8 +69,29 @@ class LoadLatencyTest(object):
     cooldown: bool
     outputdir: str
 
+    _str: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        # the test is frozen, so its string does not need to be rebuilt
+        # every time the test is logged
+        object.__setattr__(self, '_str', self.build_str())
+
+    @property
+    def net_type(self):
+        """
+        The network type of the guest's test interface
+        """
+        return 'brtap' if self.interface is Interface.BRIDGE else 'macvtap'
+
+    @property
+    def machine_type(self):
+        """
+        The Qemu machine type of the guest
+        """
+        return 'pc' if self.machine is Machine.PCVM else 'microvm'
+
     def test_infix(self):
-        if self.machine == Machine.HOST:
+        if self.machine is Machine.HOST:
             return (
                 f"{self.machine.value}_{self.interface.value}" +
                 f"_{self.reflector.value}_{self.rate}kpps_{self.size}B" +
@@ -82,31 +106,41 @@ class LoadLatencyTest(object):
                 f"_{self.runtime}s"
             )
 
+    def output_filename(self, repetition: int):
+        return f"output_{self.test_infix()}_rep{repetition}.log"
+
+    def histogram_filename(self, repetition: int):
+        return f"histogram_{self.test_infix()}_rep{repetition}.csv"
+
     def output_filepath(self, repetition: int):
-        return path_join(
-            self.outputdir,
-            f"output_{self.test_infix()}_rep{repetition}.log"
-        )
+        return path_join(self.outputdir, self.output_filename(repetition))
 
     def histogram_filepath(self, repetition: int):
-        return path_join(
-            self.outputdir,
-            f"histogram_{self.test_infix()}_rep{repetition}.csv"
-        )
+        return path_join(self.outputdir, self.histogram_filename(repetition))
+
+    def test_done(self, repetition: int, done_files: set[str] = None):
+        """
+        Check if a repetition is done
+
+        If the set of the files in the output directory is given, it is
+        used instead of checking the file system.
+        """
+        if done_files is not None:
+            return (self.output_filename(repetition) in done_files and
+                    self.histogram_filename(repetition) in done_files)
 
-    def test_done(self, repetition: int):
         output_file = self.output_filepath(repetition)
         histogram_file = self.histogram_filepath(repetition)
 
         return isfile(output_file) and isfile(histogram_file)
 
-    def needed(self):
+    def needed(self, done_files: set[str] = None):
         for repetition in range(self.repetitions):
-            if not self.test_done(repetition):
+            if not self.test_done(repetition, done_files):
                 return True
         return False
 
-    def __str__(self):
+    def build_str(self):
         return ("LoadLatencyTest(" +
                 f"machine={self.machine.value}, " +
                 f"interface={self.interface.value}, " +
@@ -121,6 +155,26 @@ class LoadLatencyTest(object):
                 f"repetitions={self.repetitions}, " +
                 f"outputdir={self.outputdir})")
 
+    def __str__(self):
+        return self._str
+
+    def estimated_duration(self, done_files: set[str] = None):
+        """
+        Estimate the duration of the test in seconds
+
+        This only adds up the sleeps and runtimes of run() for the
+        repetitions that are not done yet, which run() does not skip, so it
+        is a lower bound. The set of the files in the output directory is
+        used like in test_done().
+        """
+        duration = 35 if self.warmup else 0
+        repetition_duration = self.runtime + 6
+        if self.cooldown:
+            repetition_duration += 20
+        todo = sum(1 for repetition in range(self.repetitions)
+                   if not self.test_done(repetition, done_files))
+        return duration + todo * repetition_duration
+
     def run(self, loadgen: LoadGen):
         info(f"Running test {self}")
 
@@ -208,67 +262,133 @@ class LoadLatencyTest(object):
                 f.write(f'{key},{value}\n')
 
 
-@dataclass
+@dataclass(slots=True)
 class LoadLatencyTestGenerator(object):
     """
     Load latency test generator class
     """
-    machines: set[Machine]
-    interfaces: set[Interface]
-    qemus: set[str]
-    vhosts: set[bool]
-    ioregionfds: set[bool]
-    reflectors: set[Reflector]
-    rates: set[int]
+    machines: frozenset[Machine]
+    interfaces: frozenset[Interface]
+    qemus: frozenset[str]
+    vhosts: frozenset[bool]
+    ioregionfds: frozenset[bool]
+    reflectors: frozenset[Reflector]
+    rates: frozenset[int]
     size: int
-    runtimes: set[int]
+    runtimes: frozenset[int]
     repetitions: int
     warmup: bool
     cooldown: bool
     accumulate: bool
     outputdir: str
 
-    full_test_tree: dict = field(init=False, repr=False, default=None)
-    todo_test_tree: dict = field(init=False, repr=False, default=None)
+    full_tests: list = field(init=False, repr=False, default=None)
+    todo_tests: list = field(init=False, repr=False, default=None)
+    qemu_paths: dict = field(init=False, repr=False, default=None)
+    guest_machines: frozenset = field(init=False, repr=False, default=None)
+    guest_interfaces: frozenset = field(init=False, repr=False,
+                                        default=None)
+    done_setups: set = field(init=False, repr=False, default_factory=set)
+    remaining_duration: int = field(init=False, repr=False, default=0)
 
     def __post_init__(self):
+        self.machines = frozenset(self.machines)
+        self.interfaces = frozenset(self.interfaces)
+        self.qemus = frozenset(self.qemus)
+        self.vhosts = frozenset(self.vhosts)
+        self.ioregionfds = frozenset(self.ioregionfds)
+        self.reflectors = frozenset(self.reflectors)
+        self.rates = frozenset(self.rates)
+        self.runtimes = frozenset(self.runtimes)
+
         info('Initializing test generator:')
         info(f'  machines   : {set(m.value for m in self.machines)}')
         info(f'  interfaces : {set(i.value for i in self.interfaces)}')
-        info(f'  qemus      : {self.qemus}')
-        info(f'  vhosts     : {self.vhosts}')
-        info(f'  ioregionfds: {self.ioregionfds}')
+        info(f'  qemus      : {set(self.qemus)}')
+        info(f'  vhosts     : {set(self.vhosts)}')
+        info(f'  ioregionfds: {set(self.ioregionfds)}')
         info(f'  reflectors : {set(r.value for r in self.reflectors)}')
-        info(f'  rates      : {self.rates}')
+        info(f'  rates      : {set(self.rates)}')
         info(f'  size       : {self.size}')
-        info(f'  runtimes   : {self.runtimes}')
+        info(f'  runtimes   : {set(self.runtimes)}')
         info(f'  repetitions: {self.repetitions}')
         info(f'  warmup     : {self.warmup}')
         info(f'  cooldown   : {self.cooldown}')
         info(f'  accumulate : {self.accumulate}')
         info(f'  outputdir  : {self.outputdir}')
 
+        # Qemus are given as name:path, the name goes to the test runner,
+        # the path to the qemu build directory is just used to start the
+        # guest. An empty path means the installed qemu is used.
+        # TODO In case no name is given, we could number them.
+        self.qemu_paths = dict(q.split(':', 1) for q in self.qemus)
+
+        # guests neither run on the host machine nor get the physical NIC
+        self.guest_machines = self.machines - {Machine.HOST}
+        self.guest_interfaces = self.interfaces - {Interface.PNIC}
+
     def generate(self, host: Host):
-        self.full_test_tree = self.create_test_tree(host)
-        self.todo_test_tree = self.create_needed_test_tree(self.full_test_tree)
+        self.full_tests = self.create_tests(host)
+        self.todo_tests = self.create_needed_tests(self.full_tests)
+
+    def setup_once(self, server: Server, setup: str):
+        """
+        Run a setup method of a server only once per test run
+
+        This is for setups that are not undone until the end of the run,
+        like the hugetlbfs or the admin tap, so there is no need to repeat
+        them for every interface, guest or reflector.
+        """
+        if (server.fqdn, setup) in self.done_setups:
+            debug(f'Skipping {setup} on {server.fqdn}, already done')
+            return
+        getattr(server, setup)()
+        self.done_setups.add((server.fqdn, setup))
+
+    def forget_setups(self, server: Server):
+        """
+        Forget the setups done on a server, e.g. because it was rebooted
+        """
+        self.done_setups.difference_update(
+            [(fqdn, setup) for fqdn, setup in self.done_setups
+             if fqdn == server.fqdn])
+
+    def kill_guest(self, host: Host, guest: Guest):
+        """
+        Kill the guest and forget everything tied to its previous boot
+
+        The SSH master connection to the guest dies with it, and the
+        setups done on it are lost.
+        """
+        host.kill_guest(guest)
+        self.forget_setups(guest)
 
     def setup_interface(self, host: Host, machine: Machine,
                         interface: Interface, bridge_mac: str = None):
-        if machine != Machine.HOST:
-            host.setup_admin_tap()
-        if interface == Interface.BRIDGE:
-            if machine == Machine.HOST:
+        if machine is not Machine.HOST:
+            self.setup_once(host, 'setup_admin_tap')
+        if interface is Interface.BRIDGE:
+            if machine is Machine.HOST:
                 host.setup_test_bridge()
             else:
                 host.setup_test_br_tap()
-        elif interface == Interface.MACVTAP:
+        elif interface is Interface.MACVTAP:
             host.setup_test_macvtap()
 
+    def interface_setup_key(self, test: LoadLatencyTest):
+        """
+        Get the key of the host network setup a test needs
+
+        All VM machine types need the same setup for an interface, only the
+        host machine differs.
+        """
+        return (test.machine is Machine.HOST, test.interface.value)
+
     def start_reflector(self, server: Server, reflector: Reflector,
                         iface: str = None):
-        if reflector == Reflector.MOONGEN:
+        if reflector is Reflector.MOONGEN:
             server.bind_test_iface()
-            server.setup_hugetlbfs()
+            self.setup_once(server, 'setup_hugetlbfs')
             server.start_moongen_reflector()
         else:
             server.start_xdp_reflector(iface)
@@ -276,34 +396,73 @@ class LoadLatencyTestGenerator(object):
 
     def stop_reflector(self, server: Server, reflector: Reflector,
                        iface: str = None):
-        if reflector == Reflector.MOONGEN:
+        if reflector is Reflector.MOONGEN:
             server.stop_moongen_reflector()
             server.release_test_iface()
         else:
             server.stop_xdp_reflector(iface)
 
-    def run_guest(self, host: Host, machine: Machine,
-                  interface: Interface, qemu: str, vhost: bool,
-                  ioregionfd: bool):
+    def run_guest(self, host: Host, test: LoadLatencyTest):
         host.run_guest(
-            net_type='brtap' if interface == Interface.BRIDGE else 'macvtap',
-            machine_type='pc' if machine == Machine.PCVM else 'microvm',
+            net_type=test.net_type,
+            machine_type=test.machine_type,
             root_disk=None,
             debug_qemu=False,
-            ioregionfd=ioregionfd,
-            qemu_build_dir=qemu,
-            vhost=vhost
+            ioregionfd=test.ioregionfd,
+            qemu_build_dir=self.qemu_paths[test.qemu],
+            vhost=test.vhost
         )
 
-    def create_interface_test_tree(self, machine: Machine,
-                                   interface: Interface, mac: str, qemu: str,
-                                   vhost: bool, ioregionfd: bool,
-                                   reflector: Reflector):
-        tree = {}
-        for rate in self.rates:
-            tree[rate] = {}
-            for runtime in self.runtimes:
-                test = LoadLatencyTest(
+    def valid(self, machine: Machine, interface: Interface, qemu: str,
+              vhost: bool, ioregionfd: bool, reflector: Reflector):
+        """
+        Check if a test configuration can be run
+        """
+        if machine is Machine.HOST:
+            # only the physical NIC can be bound to the MoonGen reflector
+            return interface is Interface.PNIC or \
+                reflector is not Reflector.MOONGEN
+        # the guests have no physical NIC, only microvms support
+        # ioregionfd, and they cannot run the MoonGen reflector
+        return (interface is not Interface.PNIC and
+                (not ioregionfd or machine is Machine.MICROVM) and
+                (machine is not Machine.MICROVM or
+                 reflector is not Reflector.MOONGEN))
+
+    def sort_key(self, test: LoadLatencyTest):
+        """
+        Get the key to sort the tests by
+
+        Tests are ordered by the setups they need, from the most to the
+        least expensive to change: interface setup, guest, reflector. So
+        tests sharing a setup prefix run back to back.
+        """
+        return (self.interface_setup_key(test), self.guest_key(test),
+                test.reflector.value, test.rate, test.runtime)
+
+    def guest_key(self, test: LoadLatencyTest):
+        """
+        Get the key of the guest a test runs on
+        """
+        return (test.machine.value, test.interface.value, test.qemu,
+                test.vhost, test.ioregionfd)
+
+    def create_tests(self, host: Host):
+        configs = chain(
+            product(self.machines & {Machine.HOST}, self.interfaces,
+                    [None], [None], [None], self.reflectors),
+            product(self.guest_machines, self.guest_interfaces,
+                    self.qemu_paths.keys(), self.vhosts, self.ioregionfds,
+                    self.reflectors),
+        )
+        tests = []
+        for config in filter(lambda c: self.valid(*c), configs):
+            machine, interface, qemu, vhost, ioregionfd, reflector = config
+            mac = host.guest_test_iface_mac
+            if machine is Machine.HOST:
+                mac = host.test_iface_mac
+            for rate, runtime in product(self.rates, self.runtimes):
+                tests.append(LoadLatencyTest(
                     machine=machine,
                     interface=interface,
                     mac=mac,
@@ -318,239 +477,187 @@ class LoadLatencyTestGenerator(object):
                     warmup=self.warmup,
                     cooldown=self.cooldown,
                     outputdir=self.outputdir,
-                )
-                tree[rate][runtime] = test
-        return tree
-
-    def create_test_tree(self, host: Host):
-        tree = {}
-        count = 0
-        interface_test_count = len(self.rates) * len(self.runtimes)
-        # host part
-        mac = host.test_iface_mac
-        if Machine.HOST in self.machines:
-            m = Machine.HOST
-            q = None
-            v = None
-            io = None
-            tree[m] = {}
-            for i in self.interfaces:
-                tree[m][i] = {}
-                tree[m][i][q] = {}
-                tree[m][i][q][v] = {}
-                tree[m][i][q][v][io] = {}
-                for r in self.reflectors:
-                    if (i != Interface.PNIC and
-                            r == Reflector.MOONGEN):
-                        continue
-                    tree[m][i][q][v][io][r] = \
-                        self.create_interface_test_tree(
-                            machine=m,
-                            interface=i,
-                            mac=mac,
-                            qemu=q,
-                            vhost=v,
-                            ioregionfd=io,
-                            reflector=r
-                        )
-                    count += interface_test_count
-        # vm part
-        mac = host.guest_test_iface_mac
-        for m in self.machines - {Machine.HOST}:
-            tree[m] = {}
-            for i in self.interfaces - {Interface.PNIC}:
-                tree[m][i] = {}
-                for q in self.qemus:
-                    qemu, _ = q.split(':')
-                    tree[m][i][q] = {}
-                    for v in self.vhosts:
-                        tree[m][i][q][v] = {}
-                        # for io in reversed(list(self.ioregionfds)):
-                        for io in self.ioregionfds:
-                            if io and m != Machine.MICROVM:
-                                continue
-                            tree[m][i][q][v][io] = {}
-                            for r in self.reflectors:
-                                if (m == Machine.MICROVM and
-                                        r == Reflector.MOONGEN):
-                                    continue
-                                tree[m][i][q][v][io][r] = \
-                                    self.create_interface_test_tree(
-                                        machine=m,
-                                        interface=i,
-                                        mac=mac,
-                                        qemu=qemu,
-                                        vhost=v,
-                                        ioregionfd=io,
-                                        reflector=r
-                                    )
-                                count += interface_test_count
-        info(f'Generated {count} tests')
-        return tree
-
-    def create_needed_test_tree(self, test_tree: dict):
+                ))
+        tests.sort(key=self.sort_key)
+        info(f'Generated {len(tests)} tests')
+        return tests
+
+    def done_files(self):
+        """
+        Get the set of the files in the output directory
+
+        Scanning the directory once is cheaper than checking the files of
+        every test repetition.
+        """
+        if not isdir(self.outputdir):
+            return set()
+        return set(listdir(self.outputdir))
+
+    def create_needed_tests(self, tests: list):
         info('Remove already done tests')
-        needed = deepcopy(test_tree)
-        count = 0
-        for m, mtree in test_tree.items():
-            for i, itree in mtree.items():
-                for q, qtree in itree.items():
-                    for v, vtree in qtree.items():
-                        for f, ftree in vtree.items():
-                            for r, rtree in ftree.items():
-                                for a, atree in rtree.items():
-                                    for t, test in atree.items():
-                                        if not test.needed():
-                                            del(needed[m][i][q][v][f][r][a][t])
-                                        else:
-                                            count += 1
-                                    if not needed[m][i][q][v][f][r][a]:
-                                        del(needed[m][i][q][v][f][r][a])
-                                if not needed[m][i][q][v][f][r]:
-                                    del(needed[m][i][q][v][f][r])
-                            if not needed[m][i][q][v][f]:
-                                del(needed[m][i][q][v][f])
-                        if not needed[m][i][q][v]:
-                            del(needed[m][i][q][v])
-                    if not needed[m][i][q]:
-                        del(needed[m][i][q])
-                if not needed[m][i]:
-                    del(needed[m][i])
-            if not needed[m]:
-                del(needed[m])
-        info(f'{count} tests are not done yet')
+        done_files = self.done_files()
+        needed = [test for test in tests if test.needed(done_files)]
+        info(f'{len(needed)} tests are not done yet')
+        duration = sum(test.estimated_duration(done_files) for test in needed)
+        info(f'Running them takes at least {timedelta(seconds=duration)}')
         return needed
 
+    def run_interface_tests(self, loadgen: LoadGen, tests: list,
+                            accumulator: ThreadPoolExecutor,
+                            accumulations: list[Future]):
+        """
+        Run the tests sharing an interface, guest and reflector setup
+
+        All tests share the same NIC and load generator, so they are run one
+        after the other. The accumulation of their histograms only touches
+        local files though, so it is handed to the accumulator and overlaps
+        with the following tests.
+        """
+        for test in tests:
+            # estimate before running, the done repetitions do not count
+            duration = test.estimated_duration()
+            test.run(loadgen)
+            if self.accumulate:
+                # TODO we probably need to put this somewhere else to
+                # make sure it runs even if the tests are already done
+                accumulations.append(accumulator.submit(test.accumulate))
+            self.remaining_duration -= duration
+            info('Remaining tests take at least ' +
+                 f'{timedelta(seconds=max(self.remaining_duration, 0))}')
+
+    def run_guest_tests(self, host: Host, guest: Guest, loadgen: LoadGen,
+                        tests: list, accumulator: ThreadPoolExecutor,
+                        accumulations: list[Future]):
+        """
+        Run the tests sharing the same guest boot, i.e. the same guest_key
+
+        The host network setup is the only state shared with the other
+        groups, so if the guest fails to come up, only the group's tests
+        are skipped and the run goes on with the next group.
+        """
+        test = tests[0]
+        info(f"Running {test.machine.value} {test.interface.value} tests")
+
+        if test.machine is Machine.HOST:
+            dut = host
+        else:
+            dut = guest
+            debug(f"Running guest {test.machine.value} " +
+                  f"{test.interface.value} {test.qemu} " +
+                  f"{test.vhost} {test.ioregionfd}")
+            # TODO make sure the qemu path exists and qemu is executable
+            self.run_guest(host, test)
+            # TODO maybe check if tmux session running
+
+            debug("Waiting for guest connectivity")
+            try:
+                guest.wait_for_connection(timeout=120)
+            except TimeoutError:
+                error('Waiting for connection to guest timed out, ' +
+                      f'skipping its {len(tests)} tests.')
+                # TODO recreate the guest and retry
+                self.kill_guest(host, guest)
+                self.remaining_duration -= sum(t.estimated_duration()
+                                               for t in tests)
+                return
+
+            debug("Detecting guest test interface")
+            guest.detect_test_iface()
+
+        for reflector, rtests in groupby(tests, key=lambda t: t.reflector):
+            debug(f"Starting reflector {reflector.value}")
+            self.start_reflector(dut, reflector)
+
+            self.run_interface_tests(loadgen, rtests, accumulator,
+                                     accumulations)
+
+            debug(f"Stopping reflector {reflector.value}")
+            self.stop_reflector(dut, reflector)
+
+        if test.machine is not Machine.HOST:
+            debug(f"Killing guest {test.machine.value} " +
+                  f"{test.interface.value} {test.qemu} " +
+                  f"{test.vhost} {test.ioregionfd}")
+            self.kill_guest(host, guest)
+
     def run(self, host: Host, guest: Guest, loadgen: LoadGen):
         """
         Run the tests
         """
-        # TODO Qemus should contain strings like
-        #   normal:/home/networkadmin/qemu-build
-        #   replace-ioeventfd:/home/networkadmin/qemu-build-2
-        # Empty path is also possible.
-        # Before the : is the name, this goes to the test runner.
-        # The rest is the path to the qemu build directory and just used here
-        # to start the guest.
-        # In case no name is given, we could number them.
-        if not self.todo_test_tree:
+        if not self.todo_tests:
             info('No tests to run')
             return
 
+        accumulator = ThreadPoolExecutor(max_workers=1)
+        accumulations = []
+        try:
+            self.run_tests(host, guest, loadgen, accumulator, accumulations)
+        finally:
+            accumulator.shutdown(wait=True)
+            for accumulation in accumulations:
+                if accumulation.exception():
+                    error('Failed to accumulate histograms due to ' +
+                          f'exception: {accumulation.exception()}')
+
+    def prepare_host(self, host: Host, guest: Guest):
+        """
+        Clean up the host and detect its test interface
+        """
         debug('Initial cleanup')
+        # no need to forget the guest's setups, run_tests starts without
+        # any, and the loadgen's are recorded concurrently
         try:
-            host.kill_guest()
+            host.kill_guest(guest)
         except Exception:
             pass
         host.cleanup_network()
 
+        host.detect_test_iface()
+
+    def prepare_loadgen(self, loadgen: LoadGen):
+        """
+        Bind the loadgen's test interface and set up its hugepages
+        """
         debug('Binding loadgen interface')
         loadgen.bind_test_iface()
-        loadgen.setup_hugetlbfs()
+        self.setup_once(loadgen, 'setup_hugetlbfs')
 
-        host.detect_test_iface()
+    def run_tests(self, host: Host, guest: Guest, loadgen: LoadGen,
+                  accumulator: ThreadPoolExecutor,
+                  accumulations: list[Future]):
+        """
+        Run the todo tests
 
-        for machine, mtree in self.todo_test_tree.items():
-            info(f"Running {machine.value} tests")
-
-            for interface, itree in mtree.items():
-                debug(f"Setting up interface {interface.value}")
-                self.setup_interface(host, machine, interface)
-
-                for qemu, qtree in itree.items():
-                    qemu_name = None
-                    qemu_path = None
-                    if qemu:
-                        qemu_name, qemu_path = qemu.split(':')
-                    # TODO make sure the qemu_path exists and qemu is
-                    # executable
-
-                    for vhost, vtree in qtree.items():
-                        for ioregionfd, ftree in vtree.items():
-
-                            if machine == Machine.HOST:
-                                dut = host
-                            else:
-                                dut = guest
-                                debug(f"Running guest {machine.value} " +
-                                      f"{interface.value} {qemu_name} " +
-                                      f"{vhost} {ioregionfd}")
-                                self.run_guest(host, machine, interface,
-                                               qemu_path, vhost, ioregionfd)
-                                # TODO maybe check if tmux session running
-
-                                debug("Waiting for guest connectivity")
-                                try:
-                                    guest.wait_for_connection(timeout=120)
-                                except TimeoutError:
-                                    error('Waiting for connection to guest ' +
-                                          'timed out.')
-                                    # TODO kill guest, teardown network,
-                                    # recreate and retry
-                                    return
-
-                                debug("Detecting guest test interface")
-                                guest.detect_test_iface()
-
-                            for reflector, rtree in ftree.items():
-                                debug(f"Starting reflector {reflector.value}")
-                                self.start_reflector(dut, reflector)
-
-                                for rate, atree in rtree.items():
-                                    for runtime, test in atree.items():
-                                        test.run(loadgen)
-                                        if self.accumulate:
-                                            # TODO we probably need to put
-                                            # this somewhere else to
-                                            # make sure it runs even if the
-                                            # tests are already done
-                                            test.accumulate()
-
-                                debug(f"Stopping reflector {reflector.value}")
-                                self.stop_reflector(dut, reflector)
-
-                            if machine != Machine.HOST:
-                                debug(f"Killing guest {machine.value} " +
-                                      f"{interface.value} {qemu_name} " +
-                                      f"{vhost} {ioregionfd}")
-                                host.kill_guest()
-
-                debug(f"Tearing down interface {interface.value}")
-                host.cleanup_network()
+        The todo tests are sorted by their setups, so the setups are only
+        done at the boundaries of the groups of tests sharing them.
+        """
+        self.done_setups.clear()
+        done_files = self.done_files()
+        self.remaining_duration = sum(test.estimated_duration(done_files)
+                                      for test in self.todo_tests)
+
+        parallel([(self, 'prepare_host', (host, guest)),
+                  (self, 'prepare_loadgen', (loadgen,))])
+
+        for _, itests in groupby(self.todo_tests,
+                                 key=self.interface_setup_key):
+            itests = list(itests)
+            machine, interface = itests[0].machine, itests[0].interface
+            debug(f"Setting up interface {interface.value}")
+            self.setup_interface(host, machine, interface)
+
+            for _, gtests in groupby(itests, key=self.guest_key):
+                self.run_guest_tests(host, guest, loadgen, list(gtests),
+                                     accumulator, accumulations)
+
+            debug(f"Tearing down interface {interface.value}")
+            host.cleanup_network()
 
     def force_accumulate(self):
         """
         Force accumulation of all tests
         """
-        for machine, mtree in self.full_test_tree.items():
-            for interface, itree in mtree.items():
-                for qemu, qtree in itree.items():
-                    for vhost, vtree in qtree.items():
-                        for ioregionfd, ftree in vtree.items():
-                            for reflector, rtree in ftree.items():
-                                for rate, atree in rtree.items():
-                                    for runtime, test in atree.items():
-                                        if self.accumulate:
-                                            test.accumulate(force=True)
-
-
-if __name__ == "__main__":
-    machines = {Machine.HOST, Machine.PCVM, Machine.MICROVM}
-    interfaces = {Interface.PNIC, Interface.BRIDGE, Interface.MACVTAP}
-    qemus = {"/home/networkadmin/qemu-build/qemu-system-x86_64",
-             "/home/networkadmin/qemu-build2/qemu-system-x86_64"}
-    vhosts = {True, False}
-    ioregionfds = {True, False}
-    reflectors = {Reflector.MOONGEN, Reflector.XDP}
-    rates = {1, 10, 100}
-    runtimes = {30, 60}
-    repetitions = 3
-    warmup = False
-    cooldown = False
-    accumulate = True
-    outputdir = "/home/networkadmin/loadlatency"
-
-    generator = LoadLatencyTestGenerator(
-        machines, interfaces, qemus, vhosts, ioregionfds, reflectors,
-        rates, runtimes, repetitions, warmup, cooldown, accumulate, outputdir
-    )
+        if not self.accumulate:
+            return
+        for test in self.full_tests:
+            test.accumulate(force=True)
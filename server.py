@@ -1,15 +1,267 @@
 from dataclasses import dataclass, field
-from subprocess import check_output, CalledProcessError, STDOUT
-from socket import getfqdn
+from subprocess import check_output, call, CalledProcessError, STDOUT, DEVNULL
+from socket import getfqdn, gethostname, create_connection
 from logging import debug, warning, error
 from time import sleep
+from shlex import join as shlex_join, quote as shlex_quote
+from shlex import split as shlex_split
 from datetime import datetime
+from re import findall
 from abc import ABC
-from os import listdir
-from os.path import join as path_join
+from functools import cache
+from concurrent.futures import ThreadPoolExecutor
+from shutil import copy, copytree
+from os.path import basename, join as path_join
 
 
-@dataclass
+# SSH control socket, shared by all autotest runs for the same connection
+# (%C is a hash of the local host, remote host, port and user)
+SSH_CONTROL_PATH = '/tmp/autotest-ssh-%C'
+
+# tmux session holding the windows of all commands we run in the background
+TMUX_SESSION = 'autotest'
+
+# command templates for the MoonGen programs
+REFLECTOR_CMD = ('cd {moongen_dir}; sudo bin/MoonGen '
+                 '{moonprogs_dir}/reflector.lua {iface_id}')
+LOADLATENCY_CMD = ('cd {moongen_dir}; sudo bin/MoonGen '
+                   '{moonprogs_dir}/l2-load-latency.lua '
+                   '-r {rate} -f {histfile} -t {runtime} -s {size} '
+                   '{iface_id} {mac} 2>&1 > {outfile}')
+
+# characters that make a command need a shell
+_SHELL_CHARS = frozenset('|&;<>()$`\\*?[]{}~#=\n')
+
+# extended regex of a full PCI bus address, usable with grep -E as well
+_PCI_ADDR_RE = r'[0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-7]'
+
+
+@dataclass(slots=True, kw_only=True)
+class QemuSpec:
+    """
+    Qemu command specification.
+
+    This holds the settings of a Qemu command line in structured form, so
+    the individual parts can be changed without touching the command string.
+
+    Attributes
+    ----------
+    binary : str
+        The path of the Qemu binary.
+    machine : str
+        The Qemu machine type.
+    cpu : str
+        The CPU model.
+    smp : int
+        The number of virtual CPUs.
+    mem_mb : int
+        The memory size in MiB.
+    mem_path : str
+        The path of a hugetlbfs mount to back the guest memory with, or
+        None for anonymous memory.
+    drives : list[str]
+        The drive options.
+    fsdevs : list[str]
+        The file system device options.
+    netdevs : list[str]
+        The network backend options.
+    devices : list[str]
+        The device options.
+    serial : str
+        The serial port redirection.
+    monitor : str
+        The monitor redirection.
+    prefix : list[str]
+        The command the Qemu command is run with, e.g. a debugger.
+    redirects : str
+        Shell redirections appended to the command, e.g. to pass file
+        descriptors to Qemu.
+
+    Methods
+    -------
+    to_argv : Get the argument list of the Qemu command.
+    to_command : Get the Qemu command as shell command string.
+
+    Examples
+    --------
+    >>> QemuSpec(binary='qemu-system-x86_64', machine='pc').to_argv()
+    ['qemu-system-x86_64', '-machine', 'pc', ...]
+    """
+    binary: str
+    machine: str
+    cpu: str = 'host'
+    smp: int = 4
+    mem_mb: int = 4096
+    mem_path: str = None
+    drives: list[str] = field(default_factory=list)
+    fsdevs: list[str] = field(default_factory=list)
+    netdevs: list[str] = field(default_factory=list)
+    devices: list[str] = field(default_factory=list)
+    serial: str = 'stdio'
+    monitor: str = None
+    prefix: list[str] = field(default_factory=list)
+    redirects: str = ''
+
+    def to_argv(self: 'QemuSpec') -> list[str]:
+        """
+        Get the argument list of the Qemu command.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        list[str]
+            The argument list, including the prefix command.
+        """
+        machine = self.machine
+        argv = [*self.prefix, self.binary]
+        if self.mem_path:
+            machine += ',memory-backend=mem'
+            argv += ['-object',
+                     f'memory-backend-file,id=mem,size={self.mem_mb}M,' +
+                     f'mem-path={self.mem_path},share=on']
+        argv += ['-machine', machine,
+                 '-cpu', self.cpu,
+                 '-smp', str(self.smp),
+                 '-m', str(self.mem_mb),
+                 '-enable-kvm']
+        for option, values in (('-drive', self.drives),
+                               ('-fsdev', self.fsdevs),
+                               ('-netdev', self.netdevs),
+                               ('-device', self.devices)):
+            for value in values:
+                argv += [option, value]
+        if self.serial:
+            argv += ['-serial', self.serial]
+        if self.monitor:
+            argv += ['-monitor', self.monitor]
+        return argv
+
+    def to_command(self: 'QemuSpec') -> str:
+        """
+        Get the Qemu command as shell command string.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        str
+            The quoted command, followed by the redirections.
+        """
+        command = shlex_join(self.to_argv())
+        if self.redirects:
+            command += f' {self.redirects}'
+        return command
+
+
+@cache
+def local_names() -> frozenset[str]:
+    """
+    Get the names under which the local machine may be configured.
+
+    The names are only looked up once, when first needed, since getfqdn
+    does a reverse DNS lookup that can take a while.
+
+    Parameters
+    ----------
+
+    Returns
+    -------
+    frozenset[str]
+        The names of the local machine.
+
+    Example
+    -------
+    >>> local_names()
+    frozenset({'localhost', 'server', 'server.test.de'})
+    """
+    return frozenset({'localhost', '127.0.0.1', gethostname(), getfqdn()})
+
+
+def full_pci_addr(addr: str) -> str:
+    """
+    Get the full form of a PCI bus address, including the domain.
+
+    Parameters
+    ----------
+    addr : str
+        The PCI bus address.
+
+    Returns
+    -------
+    str
+        The PCI bus address including the domain.
+
+    Example
+    -------
+    >>> full_pci_addr('51:00.0')
+    '0000:51:00.0'
+    """
+    return f'0000:{addr}' if addr.count(':') == 1 else addr
+
+
+def parallel(tasks: list[tuple[object, str, tuple]]) -> list:
+    """
+    Run independent method calls in parallel.
+
+    Each task is run in its own thread, which is fine since the calls
+    mostly wait for commands on the servers.
+
+    Parameters
+    ----------
+    tasks : list[tuple[object, str, tuple]]
+        The tasks as tuples of object, method name and arguments.
+
+    Returns
+    -------
+    list
+        The return values of the calls in the order of the tasks.
+
+    Example
+    -------
+    >>> parallel([(host, 'bind_test_iface', ()),
+    ...           (loadgen, 'bind_test_iface', ())])
+    [None, None]
+    """
+    if not tasks:
+        return []
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = [executor.submit(getattr(obj, method), *args)
+                   for obj, method, args in tasks]
+        return [future.result() for future in futures]
+
+
+def close_ssh_master(fqdn: str) -> None:
+    """
+    Close the shared SSH master connection to a host.
+
+    This only needs the host's name, so no Server object, whose creation
+    may already connect to the host, has to be created for it.
+
+    Parameters
+    ----------
+    fqdn : str
+        The fully qualified domain name of the host.
+
+    Returns
+    -------
+
+    Example
+    -------
+    >>> close_ssh_master('guest.example.com')
+    """
+    if fqdn in local_names():
+        return
+    try:
+        check_output(['ssh', '-o', f'ControlPath={SSH_CONTROL_PATH}',
+                      '-O', 'exit', fqdn], stderr=STDOUT)
+    except CalledProcessError:
+        debug(f'No SSH master connection to {fqdn} to close')
+
+
+@dataclass(slots=True, kw_only=True)
 class Server(ABC):
     """
     Server class.
@@ -49,14 +301,21 @@ class Server(ABC):
     __exec_local : Execute a command on the localhost.
     __exec_ssh : Execute a command on the server over SSH.
     exec : Execute command on the server.
-    tmux_new : Start a tmux session on the server.
-    tmux_kill : Stop a tmux session on the server.
-    tmux_send_keys : Send keys to a tmux session on the server.
+    exec_argv : Execute a command given as argument list on the server.
+    exec_script : Execute a shell script on the server.
+    exec_batch : Execute a sequence of commands on the server.
+    tmux_new : Start a tmux window on the server.
+    tmux_kill : Stop a tmux window on the server.
+    tmux_send_keys : Send keys to a tmux window on the server.
+    tmux_send_keys_many : Send several batches of keys to a tmux window.
     __copy_local : Copy a file to the localhost.
-    __scp_to : Copy a file to the server.
-    __scp_from : Copy a file from the server.
+    __rsync_to : Copy a file to the server.
+    __rsync_from : Copy a file from the server.
     copy_to : Copy a file to the server.
     copy_from : Copy a file from the server.
+    stop_tmux_session : Stop the autotest tmux session if it is idle.
+    close_ssh_master : Close the SSH master connection to the server.
+    close : Release the resources held for the server.
 
     See Also
     --------
@@ -70,11 +329,14 @@ class Server(ABC):
     test_iface: str
     test_iface_addr: str
     _test_iface_id: int = field(default=None, init=False)
+    _driver_cache: dict[str, str] = field(default_factory=dict, init=False)
+    _user: str = field(default=None, init=False)
+    _pci_bus: bool = field(default=None, init=False)
     test_iface_mac: str
     test_iface_driv: str
     moongen_dir: str
     moonprogs_dir: str
-    xdp_reflector_dir: str
+    xdp_reflector_dir: str = None
     localhost: bool = False
     nixos: bool = False
 
@@ -94,7 +356,8 @@ class Server(ABC):
         --------
         __init__ : Initialize the object.
         """
-        self.localhost = self.fqdn == 'localhost' or self.fqdn == getfqdn()
+        self.localhost = (self.fqdn in ('localhost', '127.0.0.1')
+                          or self.fqdn in local_names())
         try:
             self.nixos = self.isfile('/etc/NIXOS')
         except Exception:
@@ -118,6 +381,10 @@ class Server(ABC):
         """
         Check if the server is reachable.
 
+        This tries to connect to the server's SSH port, and only pings the
+        server if the connection attempt times out, e.g. because SSH runs on
+        another port behind a firewall.
+
         Parameters
         ----------
 
@@ -133,9 +400,19 @@ class Server(ABC):
         if self.localhost:
             return True
         else:
+            # connecting to the SSH port is faster than forking a ping
             try:
-                check_output(f'ping -c 1 -W 1 {self.fqdn}', shell=True)
-            except CalledProcessError:
+                create_connection((self.fqdn, 22), timeout=1).close()
+            except ConnectionRefusedError:
+                # the server answered, it just does not listen on the port
+                return True
+            except TimeoutError:
+                try:
+                    return call(['ping', '-c', '1', '-W', '1', self.fqdn],
+                                stdout=DEVNULL, stderr=DEVNULL) == 0
+                except FileNotFoundError:
+                    return False
+            except OSError:
                 return False
             else:
                 return True
@@ -161,8 +438,43 @@ class Server(ABC):
         exec : Execute command on the server.
         __exec_ssh : Execute a command on the server over SSH.
         """
+        # simple commands are run directly to save the shell's fork
+        if _SHELL_CHARS.isdisjoint(command):
+            try:
+                return check_output(shlex_split(command),
+                                    stderr=STDOUT).decode('utf-8')
+            except FileNotFoundError:
+                # probably a shell builtin
+                pass
         return check_output(command, stderr=STDOUT, shell=True).decode('utf-8')
 
+    def __ssh_options(self: 'Server') -> list[str]:
+        """
+        Get the SSH options for connections to the server.
+
+        All SSH and rsync calls share one master connection per server, so
+        only the first call pays for the connection setup. The master
+        outlives the process for a while, so subsequent autotest runs can
+        reuse it as well.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        list[str]
+            The SSH options as arguments for ssh.
+
+        See Also
+        --------
+        __exec_ssh : Execute a command on the server over SSH.
+        close : Release the resources held for the server.
+        """
+        return ['-o', f'ControlPath={SSH_CONTROL_PATH}',
+                '-o', 'ControlMaster=auto', '-o', 'ControlPersist=2h',
+                '-o', 'ServerAliveInterval=60',
+                '-o', 'GSSAPIAuthentication=no']
+
     def __exec_ssh(self: 'Server', command: str) -> str:
         """
         Execute a command on the server over SSH.
@@ -185,8 +497,8 @@ class Server(ABC):
         exec : Execute command on the server.
         __exec_local : Execute a command on the localhost.
         """
-        return check_output(f"ssh {self.fqdn} '{command}'",
-                            stderr=STDOUT, shell=True).decode('utf-8')
+        return check_output(['ssh', *self.__ssh_options(), self.fqdn,
+                             command], stderr=STDOUT).decode('utf-8')
 
     def exec(self: 'Server', command: str) -> str:
         """
@@ -214,12 +526,153 @@ class Server(ABC):
         >>> print(server.exec('ls -l'))
         .bashrc
         """
-        debug(f'Executing command on {self.log_name()}: {command}')
+        # lazy formatting, since this runs for every command
+        debug('Executing command on %s: %s', self.log_name(), command)
         if self.localhost:
             return self.__exec_local(command)
         else:
             return self.__exec_ssh(command)
 
+    def exec_argv(self: 'Server', argv: list[str]) -> str:
+        """
+        Execute a command given as argument list on the server.
+
+        On the localhost no shell is involved at all. Commands passed to exec
+        as strings keep going through a shell if they need one.
+
+        Parameters
+        ----------
+        argv : list[str]
+            The command and its arguments.
+
+        Returns
+        -------
+        str
+            The output of the command.
+
+        See Also
+        --------
+        exec : Execute command on the server.
+
+        Example
+        -------
+        >>> print(server.exec_argv(['ls', '-l']))
+        .bashrc
+        """
+        if not self.localhost:
+            return self.exec(shlex_join(argv))
+        debug('Executing command on %s: %s', self.log_name(), argv)
+        return check_output(argv, stderr=STDOUT).decode('utf-8')
+
+    def exec_rc(self: 'Server', command: str) -> int:
+        """
+        Execute a command on the server and get its exit code.
+
+        The output of the command is discarded. Over SSH, an exit code of
+        255 means that the connection failed, so it is raised as an error
+        like exec does, instead of returned.
+
+        Parameters
+        ----------
+        command : str
+            The command to execute.
+
+        Returns
+        -------
+        int
+            The exit code of the command.
+
+        Raises
+        ------
+        CalledProcessError
+            If the SSH connection to the server failed.
+
+        See Also
+        --------
+        exec : Execute command on the server.
+
+        Example
+        -------
+        >>> server.exec_rc('test -d /tmp')
+        0
+        """
+        debug('Executing command on %s: %s', self.log_name(), command)
+        if not self.localhost:
+            argv = ['ssh', *self.__ssh_options(), self.fqdn, command]
+            returncode = call(argv, stdout=DEVNULL, stderr=DEVNULL)
+            if returncode == 255:
+                raise CalledProcessError(returncode, argv)
+            return returncode
+
+        if not _SHELL_CHARS.isdisjoint(command):
+            return call(command, stdout=DEVNULL, stderr=DEVNULL, shell=True)
+        try:
+            return call(shlex_split(command), stdout=DEVNULL, stderr=DEVNULL)
+        except FileNotFoundError:
+            # probably a shell builtin
+            return call(command, stdout=DEVNULL, stderr=DEVNULL, shell=True)
+
+    def exec_script(self: 'Server', script: str) -> str:
+        """
+        Execute a shell script on the server.
+
+        The script is passed to bash on stdin, so a sequence of commands
+        only needs a single SSH round trip.
+
+        Parameters
+        ----------
+        script : str
+            The shell script to execute.
+
+        Returns
+        -------
+        str
+            The output of the script.
+
+        See Also
+        --------
+        exec : Execute command on the server.
+
+        Example
+        -------
+        >>> print(server.exec_script('cd /tmp\\nls -l'))
+        file.txt
+        """
+        debug('Executing script on %s:\n%s', self.log_name(), script)
+        argv = ['bash', '-s']
+        if not self.localhost:
+            argv = ['ssh', *self.__ssh_options(), self.fqdn, shlex_join(argv)]
+        return check_output(argv, input=script.encode('utf-8'),
+                            stderr=STDOUT).decode('utf-8')
+
+    def exec_batch(self: 'Server', commands: list[str]) -> str:
+        """
+        Execute a sequence of commands on the server.
+
+        The commands are run by a single shell script, which stops at the
+        first failing command just like a sequence of exec calls would.
+
+        Parameters
+        ----------
+        commands : list[str]
+            The commands to execute.
+
+        Returns
+        -------
+        str
+            The combined output of the commands.
+
+        See Also
+        --------
+        exec_script : Execute a shell script on the server.
+
+        Example
+        -------
+        >>> print(server.exec_batch(['cd /tmp', 'ls -l']))
+        file.txt
+        """
+        return self.exec_script('set -e\n' + '\n'.join(commands) + '\n')
+
     def whoami(self: 'Server') -> str:
         """
         Get the user name.
@@ -232,7 +685,9 @@ class Server(ABC):
         str
             The user name.
         """
-        return self.exec('whoami').strip()
+        if self._user is None:
+            self._user = self.exec_argv(['whoami']).strip()
+        return self._user
 
     def gethome(self: 'Server') -> str:
         """
@@ -262,17 +717,38 @@ class Server(ABC):
         bool
             True if the file exists.
         """
-        return self.exec(f'test -f {path} && echo true || echo false'
-                         ).strip() == 'true'
+        return self.exec_rc(f'test -f {path}') == 0
 
-    def tmux_new(self: 'Server', session_name: str, command: str) -> None:
+    def __tmux_target(self: 'Server', window_name: str) -> str:
         """
-        Start a tmux session on the server.
+        Get the tmux target of a window in the autotest session.
 
         Parameters
         ----------
-        session_name : str
-            The name of the session.
+        window_name : str
+            The name of the window.
+
+        Returns
+        -------
+        str
+            The tmux target, matching only the exact window name, quoted
+            for the shell.
+        """
+        return shlex_quote(f'{TMUX_SESSION}:={window_name}')
+
+    def tmux_new(self: 'Server', window_name: str, command: str) -> None:
+        """
+        Start a tmux window on the server.
+
+        All windows are opened in the autotest session, which is created
+        with an idle window if it does not exist yet. This keeps the tmux
+        server alive between the windows, so it does not have to be started
+        again for each of them.
+
+        Parameters
+        ----------
+        window_name : str
+            The name of the window.
         command : str
             The command to execute.
 
@@ -282,19 +758,26 @@ class Server(ABC):
         See Also
         --------
         exec : Execute command on the server.
-        tmux_kill : Stop a tmux session on the server.
-        tmux_send_keys : Send keys to a tmux session on the server.
-        """
-        _ = self.exec(f'tmux new-session -s {session_name} -d "{command}"')
+        tmux_kill : Stop a tmux window on the server.
+        tmux_send_keys : Send keys to a tmux window on the server.
+        """
+        _ = self.exec(
+            f'tmux has-session -t {TMUX_SESSION} 2>/dev/null || ' +
+            f'tmux new-session -d -s {TMUX_SESSION} -n idle; ' +
+            shlex_join(['tmux', 'new-window', '-d', '-t', f'{TMUX_SESSION}:',
+                        '-n', window_name, command])
+        )
 
-    def tmux_kill(self: 'Server', session_name: str) -> None:
+    def tmux_kill(self: 'Server', window_name: str) -> None:
         """
-        Stop a tmux session on the server.
+        Stop a tmux window on the server.
+
+        Nothing happens if the window does not exist.
 
         Parameters
         ----------
-        session_name : str
-            The name of the session.
+        window_name : str
+            The name of the window.
 
         Returns
         -------
@@ -302,20 +785,20 @@ class Server(ABC):
         See Also
         --------
         exec : Execute command on the server.
-        tmux_new : Start a tmux session on the server.
-        tmux_send_keys : Send keys to a tmux session on the server.
+        tmux_new : Start a tmux window on the server.
+        tmux_send_keys : Send keys to a tmux window on the server.
         """
-        _ = self.exec('tmux list-sessions | cut -d ":" -f 1 ' +
-                      f'| grep {session_name} | xargs tmux kill-session -t')
+        _ = self.exec('tmux kill-window -t ' +
+                      f'{self.__tmux_target(window_name)} 2>/dev/null || true')
 
-    def tmux_send_keys(self: 'Server', session_name: str, keys: str) -> None:
+    def tmux_send_keys(self: 'Server', window_name: str, keys: str) -> None:
         """
-        Send keys to a tmux session on the server.
+        Send keys to a tmux window on the server.
 
         Parameters
         ----------
-        session_name : str
-            The name of the session.
+        window_name : str
+            The name of the window.
         keys : str
             The keys to execute.
 
@@ -325,10 +808,40 @@ class Server(ABC):
         See Also
         --------
         exec : Execute keys on the server.
-        tmux_new : Start a tmux session on the server.
-        tmux_kill : Stop a tmux session on the server.
+        tmux_new : Start a tmux window on the server.
+        tmux_kill : Stop a tmux window on the server.
+        """
+        self.tmux_send_keys_many(window_name, [keys])
+
+    def tmux_send_keys_many(self: 'Server', window_name: str,
+                            keys_list: list[str]) -> None:
+        """
+        Send several batches of keys to a tmux window on the server.
+
+        The send-keys commands are chained in a single tmux call, so the
+        whole sequence only takes one round trip.
+
+        Parameters
+        ----------
+        window_name : str
+            The name of the window.
+        keys_list : list[str]
+            The keys to send, one entry per send-keys command.
+
+        Returns
+        -------
+
+        See Also
+        --------
+        tmux_send_keys : Send keys to a tmux window on the server.
+
+        Example
+        -------
+        >>> server.tmux_send_keys_many('qemu', ['C-c', '"ls -l" Enter'])
         """
-        _ = self.exec(f'tmux send-keys -t {session_name} {keys}')
+        target = self.__tmux_target(window_name)
+        _ = self.exec('tmux ' + ' \\; '.join(f'send-keys -t {target} {keys}'
+                                             for keys in keys_list))
 
     def __copy_local(self: 'Server', source: str, destination: str) -> None:
         """
@@ -351,9 +864,33 @@ class Server(ABC):
         copy : Copy a file from the server to the localhost.
         __copy_ssh : Copy a file from the server to the server over SSH.
         """
-        self.__exec_local(f'cp {source} {destination}')
+        # copies in the kernel, without forking cp
+        copy(source, destination)
+
+    def __rsync_options(self: 'Server') -> list[str]:
+        """
+        Get the rsync options for copies from and to the server.
+
+        Files are copied as a whole, since the delta algorithm does not pay
+        off on the fast links to our servers, but unchanged files are
+        skipped.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        list[str]
+            The rsync options.
+
+        See Also
+        --------
+        __ssh_options : Get the SSH options for connections to the server.
+        """
+        return ['--archive', '--inplace', '--whole-file',
+                '--rsh', shlex_join(['ssh', *self.__ssh_options()])]
 
-    def __scp_to(self: 'Server', source: str, destination: str) -> None:
+    def __rsync_to(self: 'Server', source: str, destination: str) -> None:
         """
         Copy a file from the localhost to the server.
 
@@ -374,11 +911,12 @@ class Server(ABC):
         --------
         copy : Copy a file from the server to the localhost.
         __copy_local : Copy a file from the server to the server over SSH.
-        __scp_from : Copy a file from the server to the server over SSH.
+        __rsync_from : Copy a file from the server to the server over SSH.
         """
-        self.__exec_local(f'scp {source} {self.fqdn}:{destination}')
+        check_output(['rsync', *self.__rsync_options(), source,
+                      f'{self.fqdn}:{destination}'], stderr=STDOUT)
 
-    def __scp_from(self: 'Server', source: str, destination: str) -> None:
+    def __rsync_from(self: 'Server', source: str, destination: str) -> None:
         """
         Copy a file from the server to the localhost.
 
@@ -399,9 +937,10 @@ class Server(ABC):
         --------
         copy : Copy a file from the server to the localhost.
         __copy_local : Copy a file from the server to the server over SSH.
-        __scp_to : Copy a file from the server to the server over SSH.
+        __rsync_to : Copy a file from the server to the server over SSH.
         """
-        self.__exec_local(f'scp {self.fqdn}:{source} {destination}')
+        check_output(['rsync', *self.__rsync_options(),
+                      f'{self.fqdn}:{source}', destination], stderr=STDOUT)
 
     def copy_to(self: 'Server', source: str, destination: str) -> None:
         """
@@ -420,18 +959,18 @@ class Server(ABC):
         See Also
         --------
         __copy_local : Copy a file from the server to the server over SSH.
-        __scp_to : Copy a file from the server to the server over SSH.
+        __rsync_to : Copy a file from the server to the server over SSH.
         copy_from : Copy a file from the server to the localhost.
 
         Example
         -------
         >>> server.copy_to('/home/user/file.txt', '/home/user/file.txt')
         """
-        debug(f'Copying {source} to {self.log_name()}:{destination}')
+        debug('Copying %s to %s:%s', source, self.log_name(), destination)
         if self.localhost:
             self.__copy_local(source, destination)
         else:
-            self.__scp_to(source, destination)
+            self.__rsync_to(source, destination)
 
     def copy_from(self: 'Server', source: str, destination: str) -> None:
         """
@@ -450,24 +989,128 @@ class Server(ABC):
         See Also
         --------
         __copy_local : Copy a file from the server to the server over SSH.
-        __scp_from : Copy a file from the server to the server over SSH.
+        __rsync_from : Copy a file from the server to the server over SSH.
         copy_to : Copy a file from the localhost to the server.
 
         Example
         -------
         >>> server.copy_from('/home/user/file.txt', '/home/user/file.txt')
         """
-        debug(f'Copying from {self.log_name()}:{source} to {destination}')
+        debug('Copying from %s:%s to %s', self.log_name(), source,
+              destination)
         if self.localhost:
             self.__copy_local(source, destination)
         else:
-            self.__scp_from(source, destination)
+            self.__rsync_from(source, destination)
+
+    def __enter__(self: 'Server') -> 'Server':
+        """
+        Enter the runtime context of the server.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        Server
+            The server itself.
+
+        See Also
+        --------
+        close : Release the resources held for the server.
+        """
+        return self
+
+    def __exit__(self: 'Server', *_) -> None:
+        """
+        Exit the runtime context of the server.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        See Also
+        --------
+        close : Release the resources held for the server.
+        """
+        self.close()
+
+    def stop_tmux_session(self: 'Server') -> None:
+        """
+        Stop the autotest tmux session if only its idle window is left.
+
+        Commands still running in the background, like a guest started
+        with run_guest, are therefore not killed.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        See Also
+        --------
+        tmux_new : Start a tmux window on the server.
+        close : Release the resources held for the server.
+        """
+        try:
+            self.exec('[ "$(tmux list-windows -t ' +
+                      f'{TMUX_SESSION} 2>/dev/null | wc -l)" -ne 1 ] || ' +
+                      f'tmux kill-session -t {TMUX_SESSION}')
+        except Exception:
+            debug(f'Could not stop the tmux session on {self.log_name()}')
+
+    def close_ssh_master(self: 'Server') -> None:
+        """
+        Close the SSH master connection to the server.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        See Also
+        --------
+        __ssh_options : Get the SSH options for connections to the server.
+        close : Release the resources held for the server.
+        """
+        if not self.localhost:
+            close_ssh_master(self.fqdn)
+
+    def close(self: 'Server') -> None:
+        """
+        Release the resources held for the server.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        See Also
+        --------
+        stop_tmux_session : Stop the autotest tmux session if it is idle.
+        close_ssh_master : Close the SSH master connection to the server.
+
+        Example
+        -------
+        >>> with LoadGen(...) as loadgen:
+        ...     loadgen.bind_test_iface()
+        """
+        self.stop_tmux_session()
+        self.close_ssh_master()
 
     def wait_for_success(self: 'Server', command: str, timeout: int = 10
                          ) -> None:
         """
         Wait for a command to succeed.
 
+        The command is retried with an exponential backoff, starting at
+        50 ms and capped at one second between attempts.
+
         Parameters
         ----------
         command : str
@@ -483,12 +1126,14 @@ class Server(ABC):
         exec : Execute command on the server.
         """
         start = datetime.now()
+        delay = 0.05
         while (datetime.now() - start).total_seconds() < timeout:
             try:
                 _ = self.exec(command)
                 return
             except Exception:
-                sleep(1)
+                sleep(delay)
+                delay = min(delay * 2, 1)
 
         raise TimeoutError(f'Execution on {self.log_name()} of command ' +
                            f'{command} timed out after {timeout} seconds')
@@ -524,13 +1169,46 @@ class Server(ABC):
         Returns
         -------
         str
-            The driver for the device.
+            The driver for the device, or an empty string if the device is
+            not bound to any driver.
+
+        See Also
+        --------
+        """
+        device_addr = full_pci_addr(device_addr)
+        if device_addr not in self._driver_cache:
+            self._driver_cache[device_addr] = basename(self.exec(
+                f'readlink /sys/bus/pci/devices/{device_addr}/driver || true'
+            ).strip())
+        return self._driver_cache[device_addr]
+
+    def forget_drivers(self: 'Server', device_addr: str = None) -> None:
+        """
+        Forget the cached device drivers.
+
+        The drivers of the devices only change when we (re)bind them, so
+        this has to be called whenever a binding is changed. Since the
+        DPDK ID of the test interface depends on which devices are bound
+        to DPDK, it is forgotten as well.
+
+        Parameters
+        ----------
+        device_addr : str
+            The PCI bus address of the device whose driver changes. If not
+            given, the drivers of all devices are forgotten.
+
+        Returns
+        -------
 
         See Also
         --------
+        get_driver_for_device : Get the driver for a device.
         """
-        return self.exec(f'lspci -v -s {device_addr} | grep driver ' +
-                         '| cut -d":" -f 2 | tr -d " "').replace('\n', '')
+        if device_addr:
+            self._driver_cache.pop(full_pci_addr(device_addr), None)
+        else:
+            self._driver_cache.clear()
+        self._test_iface_id = None
 
     def get_driver_for_nic(self: 'Server', iface: str) -> str:
         """
@@ -593,6 +1271,32 @@ class Server(ABC):
         """
         return self.get_driver_for_device(self.test_iface_addr) == 'igb_uio'
 
+    def __exec_dpdk(self: 'Server', command: str) -> str:
+        """
+        Execute a command that needs the DPDK tools on the server.
+
+        On NixOS the command is run in a nix-shell providing DPDK. Setting
+        up the nix-shell is slow, so related commands should be chained
+        into one command instead of executed one by one.
+
+        Parameters
+        ----------
+        command : str
+            The command to execute.
+
+        Returns
+        -------
+        str
+            The output of the command.
+
+        See Also
+        --------
+        exec : Execute command on the server.
+        """
+        if self.nixos:
+            return self.exec(f'nix-shell -p dpdk --run "{command}"')
+        return self.exec(command)
+
     def bind_device(self: 'Server', dev_addr: str, driver: str) -> None:
         """
         Bind a device to a driver.
@@ -609,10 +1313,9 @@ class Server(ABC):
         """
         cmd = f'sudo dpdk-devbind.py -b {driver} {dev_addr}'
 
-        if self.nixos:
-            _ = self.exec(f'nix-shell -p dpdk --run "{cmd}"')
-        else:
-            _ = self.exec(cmd)
+        self.forget_drivers(dev_addr)
+        _ = self.__exec_dpdk(cmd)
+        self._driver_cache[full_pci_addr(dev_addr)] = driver
 
     def unbind_device(self: 'Server', dev_addr: str) -> None:
         """
@@ -628,10 +1331,9 @@ class Server(ABC):
         """
         cmd = f'sudo dpdk-devbind.py -u {dev_addr}'
 
-        if self.nixos:
-            _ = self.exec(f'nix-shell -p dpdk --run "{cmd}"')
-        else:
-            _ = self.exec(cmd)
+        self.forget_drivers(dev_addr)
+        _ = self.__exec_dpdk(cmd)
+        self._driver_cache[full_pci_addr(dev_addr)] = ''
 
     def bind_nics_to_dpdk(self: 'Server') -> None:
         """
@@ -645,10 +1347,8 @@ class Server(ABC):
         """
         cmd = f'cd {self.moongen_dir}/bin/libmoon; sudo ./bind-interfaces.sh'
 
-        if self.nixos:
-            _ = self.exec(f'nix-shell -p dpdk --run "{cmd}"')
-        else:
-            _ = self.exec(cmd)
+        self.forget_drivers()
+        _ = self.__exec_dpdk(cmd)
 
     def bind_test_iface(self: 'Server') -> None:
         """
@@ -664,18 +1364,18 @@ class Server(ABC):
         if not (self.test_iface_addr and self.test_iface_driv):
             self.detect_test_iface()
 
-        # check if test interface is already bound
-        if self.is_test_iface_bound():
+        # check if test interface is already bound, which is the case
+        # exactly if it has a DPDK ID
+        if self._test_iface_id is None:
+            self._test_iface_id = self.__find_test_iface_id()
+        if self._test_iface_id is not None:
             debug(f"{self.fqdn}'s test interface already bound to DPDK.")
-            if not self._test_iface_id:
-                self.detect_test_iface_id()
             return
 
-        # bind test interface to DPDK
-        self.bind_device(self.test_iface_addr, 'igb_uio')
-
-        # get the test interface id
-        self.detect_test_iface_id()
+        # bind test interface to DPDK and get its id in the same call
+        self._test_iface_id = self.__find_test_iface_id(bind=True)
+        if self._test_iface_id is None:
+            error(f"Failed to detect {self.fqdn}'s test interface DPDK id.")
 
     def release_test_iface(self: 'Server') -> None:
         """
@@ -699,23 +1399,56 @@ class Server(ABC):
         Returns
         -------
         """
-        cmd = "dpdk-devbind.py -s | grep 'drv=igb_uio' || true"
-        output: str
-        if self.nixos:
-            output = self.exec(f'nix-shell -p dpdk --run "{cmd}"')
-        else:
-            output = self.exec(cmd)
-
         debug(f"Detecting test interface DPDK id on {self.fqdn}")
 
-        for num, line in enumerate(output.splitlines()):
-            if line.startswith(self.test_iface_addr):
-                self._test_iface_id = num
-                debug(f"Detected {self.fqdn}'s test interface DPDK id: {num}")
-                return
+        self._test_iface_id = self.__find_test_iface_id()
+        if self._test_iface_id is not None:
+            debug(f"Detected {self.fqdn}'s test interface DPDK id: " +
+                  f"{self._test_iface_id}")
+            return
 
         error(f"Failed to detect {self.fqdn}'s test interface DPDK id.")
 
+    def __find_test_iface_id(self: 'Server', bind: bool = False) -> int:
+        """
+        Find the test interface's DPDK ID.
+
+        Since only interfaces bound to DPDK have an ID, this also tells
+        whether the test interface is bound, which is recorded in the driver
+        cache.
+
+        Parameters
+        ----------
+        bind : bool
+            Bind the test interface to DPDK first, in the same command.
+
+        Returns
+        -------
+        int
+            The DPDK ID, or None if the test interface is not bound to DPDK.
+
+        See Also
+        --------
+        detect_test_iface_id : Detect the test interface's DPDK ID.
+        get_driver_for_device : Get the driver for a device.
+        """
+        # the ID is the index among the DPDK bound network devices, so let
+        # awk count them and stop at the test interface
+        addr = self.test_iface_addr.replace('.', '\\.')
+        cmd = ("dpdk-devbind.py --status-dev net | awk '/drv=igb_uio/ " +
+               f"{{ if (/^{addr} /) {{ print n + 0; exit }} n++ }}'")
+        if bind:
+            self.forget_drivers(self.test_iface_addr)
+            cmd = (f'sudo dpdk-devbind.py -b igb_uio {self.test_iface_addr}'
+                   + f' > /dev/null && {cmd}')
+        # the ID is the last line, the binding may warn on stderr before it
+        output = self.__exec_dpdk(cmd).split()
+
+        if not output or not output[-1].isdigit():
+            return None
+        self._driver_cache[full_pci_addr(self.test_iface_addr)] = 'igb_uio'
+        return int(output[-1])
+
     def has_pci_bus(self: 'Server') -> bool:
         """
         Check if the server has a PCI bus.
@@ -728,7 +1461,9 @@ class Server(ABC):
         bool
             True if the server has a PCI bus.
         """
-        return self.exec('lspci')
+        if self._pci_bus is None:
+            self._pci_bus = bool(self.exec_argv(['lspci']))
+        return self._pci_bus
 
     def detect_test_iface_by_mac(self: 'Server') -> None:
         """
@@ -740,22 +1475,34 @@ class Server(ABC):
         Returns
         -------
         """
-        output = self.exec("for d in /sys/class/net/*; " +
-                           "do echo $(basename $d) $(cat $d/address); done")
         debug(f"Detecting test interface on {self.fqdn}")
-
-        for line in output.splitlines():
-            iface, mac = line.split()
-            if mac != self.test_iface_mac:
-                continue
-            self.test_iface = iface
+        # find the interface, its PCI address and its driver in one go
+        output = self.exec_script(
+            'for d in /sys/class/net/*; do\n'
+            f'  [ "$(cat $d/address)" = "{self.test_iface_mac}" ] '
+            '|| continue\n'
+            '  if [ -z "$(lspci 2>/dev/null)" ]; then\n'
+            '    basename $d\n'
+            '    exit\n'
+            '  fi\n'
+            '  addr=$(realpath $d/device '
+            f"| grep -oE '{_PCI_ADDR_RE}' | tail -n 1)\n"
+            '  driver=$(readlink /sys/bus/pci/devices/$addr/driver)\n'
+            '  echo $(basename $d) $addr $(basename "$driver")\n'
+            '  exit\n'
+            'done\n'
+        ).split()
+
+        if output:
+            self.test_iface = output[0]
             debug(f"Detected {self.fqdn}'s test interface: {self.test_iface}")
 
-            if not self.has_pci_bus():
+            if len(output) == 1:
                 return
 
-            self.test_iface_addr = self.get_nic_pci_address(self.test_iface)
-            self.test_iface_driv = self.get_driver_for_nic(self.test_iface)
+            self.test_iface_addr = output[1]
+            self.test_iface_driv = output[2] if len(output) > 2 else ''
+            self._driver_cache[self.test_iface_addr] = self.test_iface_driv
             return
 
         error(f"Failed to detect {self.fqdn}'s test interface.")
@@ -805,15 +1552,24 @@ class Server(ABC):
         str
             The PCI bus address.
 
+        Raises
+        ------
+        ValueError
+            If the network interface is not backed by a PCI device.
+
         Example
         -------
         >>> server.get_nic_pci_address('enp176s0')
         '0000:b0:00.0'
         """
-        return self.exec(
-            f"basename $(realpath /sys/class/net/{iface}/device " +
-            "| sed \"s/\\/virtio[0-9]//g\")"
-        ).replace('\n', '')
+        # the device may be a child of the PCI device, e.g. for virtio;
+        # virtual interfaces have no device at all
+        addrs = findall(_PCI_ADDR_RE, self.exec_argv(
+            ['realpath', '-m', f'/sys/class/net/{iface}/device']))
+        if not addrs:
+            raise ValueError(f'Network interface {iface} on ' +
+                             f'{self.log_name()} is not a PCI device')
+        return addrs[-1]
 
     def get_nic_mac_address(self: 'Server', iface: str) -> str:
         """
@@ -834,7 +1590,7 @@ class Server(ABC):
         >>> server.get_nic_pci_address('enp176s0')
         '64:9d:99:b1:0b:59'
         """
-        return self.exec(f'cat /sys/class/net/{iface}/address')
+        return self.exec_argv(['cat', f'/sys/class/net/{iface}/address'])
 
     def start_moongen_reflector(self: 'Server'):
         """
@@ -846,9 +1602,11 @@ class Server(ABC):
         Returns
         -------
         """
-        self.tmux_new('reflector', f'cd {self.moongen_dir}; sudo bin/MoonGen '
-                      + path_join(self.moonprogs_dir, 'reflector.lua') +
-                      f' {self._test_iface_id}')
+        self.tmux_new('reflector', REFLECTOR_CMD.format(
+            moongen_dir=self.moongen_dir,
+            moonprogs_dir=self.moonprogs_dir,
+            iface_id=self._test_iface_id
+        ))
 
     def stop_moongen_reflector(self: 'Server'):
         """
@@ -881,9 +1639,11 @@ class Server(ABC):
         refl_obj_file_path = path_join(self.xdp_reflector_dir, 'reflector.o')
         if not iface:
             iface = self.test_iface
-        self.exec(f'sudo ip link set {iface} xdpgeneric obj ' +
-                  f'{refl_obj_file_path} sec xdp')
-        self.exec(f'sudo ip link set {iface} up')
+        self.exec_batch([
+            shlex_join(['sudo', 'ip', 'link', 'set', iface, 'xdpgeneric',
+                        'obj', refl_obj_file_path, 'sec', 'xdp']),
+            shlex_join(['sudo', 'ip', 'link', 'set', iface, 'up']),
+        ])
 
     def stop_xdp_reflector(self: 'Server', iface: str = None):
         """
@@ -903,7 +1663,8 @@ class Server(ABC):
         """
         if not iface:
             iface = self.test_iface
-        self.exec(f'sudo ip link set {iface} xdpgeneric off')
+        self.exec_argv(['sudo', 'ip', 'link', 'set', iface, 'xdpgeneric',
+                        'off'])
 
     def upload_moonprogs(self: 'Server', source_dir: str):
         """
@@ -918,10 +1679,16 @@ class Server(ABC):
         -------
         """
         self.exec(f'mkdir -p {self.moonprogs_dir}')
-        for file in listdir(source_dir):
-            self.copy_to(path_join(source_dir, file), self.moonprogs_dir)
+        # copy the directory's content at once instead of file by file
+        debug('Copying %s to %s:%s', source_dir, self.log_name(),
+              self.moonprogs_dir)
+        if self.localhost:
+            copytree(source_dir, self.moonprogs_dir, dirs_exist_ok=True)
+        else:
+            self.__rsync_to(path_join(source_dir, ''), self.moonprogs_dir)
 
 
+@dataclass(slots=True, kw_only=True)
 class Host(Server):
     """
     Host class.
@@ -929,6 +1696,27 @@ class Host(Server):
     This class represents a host, so the server that runs guest VMs. In out
     case it is also used for physical NIC tests.
 
+    Attributes
+    ----------
+    admin_bridge : str
+        The network interface identifier of the admin bridge interface.
+    admin_bridge_ip_net : str
+        The IP address and subnet mask of the admin bridge interface.
+    admin_tap : str
+        The network interface identifier of the admin tap interface.
+    test_bridge : str
+        The network interface identifier of the test bridge interface.
+    test_tap : str
+        The network interface identifier of the test tap interface.
+    test_macvtap : str
+        The network interface identifier of the test macvtap interface.
+    guest_admin_iface_mac : str
+        The MAC address of the guest admin interface.
+    guest_test_iface_mac : str
+        The MAC address of the guest test interface.
+    guest_root_disk_path : str
+        The path to the root disk of the guest.
+
     See Also
     --------
     Server : Server class.
@@ -950,94 +1738,6 @@ class Host(Server):
     guest_test_iface_mac: str
     guest_root_disk_path: str
 
-    def __init__(self: 'Host',
-                 fqdn: str,
-                 admin_bridge: str,
-                 admin_bridge_ip_net: str,
-                 admin_tap: str,
-                 test_iface: str,
-                 test_iface_addr: str,
-                 test_iface_mac: str,
-                 test_iface_driv: str,
-                 test_bridge: str,
-                 test_tap: str,
-                 test_macvtap: str,
-                 guest_root_disk_path: str,
-                 guest_admin_iface_mac: str,
-                 guest_test_iface_mac: str,
-                 moongen_dir: str,
-                 moonprogs_dir: str,
-                 xdp_reflector_dir: str,
-                 localhost: bool = False) -> None:
-        """
-        Initialize the Host class.
-
-        Parameters
-        ----------
-        fqdn : str
-            The fully qualified domain name of the host.
-        admin_bridge : str
-            The network interface identifier of the admin bridge interface.
-        admin_bridge_ip_net : str
-            The IP address and subnet mask of the admin bridge interface.
-        admin_tap : str
-            The network interface identifier of the admin tap interface.
-        test_iface : str
-            The name of the test interface.
-        test_iface_addr : str
-            The IP address of the test interface.
-        test_iface_mac : str
-            The MAC address of the test interface.
-        test_iface_driv : str
-            The driver of the test interface.
-        test_bridge : str
-            The network interface identifier of the test bridge interface.
-        test_tap : str
-            The network interface identifier of the test tap interface.
-        test_macvtap : str
-            The network interface identifier of the test macvtap interface.
-        guest_root_disk_path : str
-            The path to the root disk of the guest.
-        guest_admin_iface_mac : str
-            The MAC address of the guest admin interface.
-        guest_test_iface_mac : str
-            The MAC address of the guest test interface.
-        moongen_dir : str
-            The directory of the MoonGen installation.
-        moonprogs_dir : str
-            The directory with the MoonGen Lua programs.
-        xdp_reflector_dir : str
-            The directory of the xdp reflector installation.
-        localhost : bool
-            True if the host is localhost.
-
-        Returns
-        -------
-        Host : The Host object.
-
-        See Also
-        --------
-        Server : The Server class.
-        Server.__init__ : Initialize the Server class.
-
-        Examples
-        --------
-        >>> Host('server.test.de')
-        Host(fqdn='server.test.de')
-        """
-        super().__init__(fqdn, test_iface, test_iface_addr, test_iface_mac,
-                         test_iface_driv, moongen_dir, moonprogs_dir,
-                         xdp_reflector_dir, localhost)
-        self.admin_bridge = admin_bridge
-        self.admin_bridge_ip_net = admin_bridge_ip_net
-        self.admin_tap = admin_tap
-        self.test_bridge = test_bridge
-        self.test_tap = test_tap
-        self.test_macvtap = test_macvtap
-        self.guest_test_iface_mac = guest_test_iface_mac
-        self.guest_admin_iface_mac = guest_admin_iface_mac
-        self.guest_root_disk_path = guest_root_disk_path
-
     def setup_admin_bridge(self: 'Host'):
         """
         Setup the admin bridge.
@@ -1048,12 +1748,14 @@ class Host(Server):
         Returns
         -------
         """
-        self.exec('sudo modprobe bridge')
-        self.exec(f'sudo ip link show {self.admin_bridge} 2>/dev/null' +
-                  f' || (sudo ip link add {self.admin_bridge} type bridge; ' +
-                  f'sudo ip addr add {self.admin_bridge_ip_net} ' +
-                  f'dev {self.admin_bridge}; true)')
-        self.exec(f'sudo ip link set {self.admin_bridge} up')
+        self.exec_batch([
+            'sudo modprobe bridge',
+            f'[ -e /sys/class/net/{self.admin_bridge} ]' +
+            f' || (sudo ip link add {self.admin_bridge} type bridge; ' +
+            f'sudo ip addr add {self.admin_bridge_ip_net} ' +
+            f'dev {self.admin_bridge}; true)',
+            f'sudo ip link set {self.admin_bridge} up',
+        ])
 
     def setup_admin_tap(self: 'Host'):
         """
@@ -1068,12 +1770,14 @@ class Host(Server):
         Returns
         -------
         """
-        self.exec('sudo modprobe tun tap')
-        self.exec(f'sudo ip link show {self.admin_tap} 2>/dev/null' +
-                  f' || (sudo ip tuntap add {self.admin_tap} mode tap;' +
-                  f' sudo ip link set {self.admin_tap} '
-                  f'master {self.admin_bridge}; true)')
-        self.exec(f'sudo ip link set {self.admin_tap} up')
+        self.exec_batch([
+            'sudo modprobe tun tap',
+            f'[ -e /sys/class/net/{self.admin_tap} ]' +
+            f' || (sudo ip tuntap add {self.admin_tap} mode tap;' +
+            f' sudo ip link set {self.admin_tap} ' +
+            f'master {self.admin_bridge}; true)',
+            f'sudo ip link set {self.admin_tap} up',
+        ])
 
     def setup_test_br_tap(self: 'Host'):
         """
@@ -1088,32 +1792,30 @@ class Host(Server):
         Returns
         -------
         """
-        # load kernel modules
-        self.exec('sudo modprobe bridge tun tap')
-
-        # create bridge and tap device
-        self.exec(f'sudo ip link show {self.test_bridge} 2>/dev/null ' +
-                  f' || (sudo ip link add {self.test_bridge} type bridge; ' +
-                  'true)')
-        username = self.whoami()
-        self.exec(f'sudo ip link show {self.test_tap} 2>/dev/null || ' +
-                  f'(sudo ip tuntap add dev {self.test_tap} mode tap ' +
-                  f'user {username} multi_queue; true)')
-
-        # add tap device and physical nic to bridge
-        tap_output = self.exec(f'sudo ip link show {self.test_tap}')
-        if f'master {self.test_bridge}' not in tap_output:
-            self.exec(f'sudo ip link set {self.test_tap} ' +
-                      f'master {self.test_bridge}')
-        test_iface_output = self.exec(f'sudo ip link show {self.test_iface}')
-        if f'master {self.test_bridge}' not in test_iface_output:
-            self.exec(f'sudo ip link set {self.test_iface} ' +
-                      f'master {self.test_bridge}')
-
-        # bring up all interfaces (nic, bridge and tap)
-        self.exec(f'sudo ip link set {self.test_iface} up ' +
-                  f'&& sudo ip link set {self.test_bridge} up ' +
-                  f'&& sudo ip link set {self.test_tap} up')
+        self.exec_batch([
+            # load kernel modules
+            'sudo modprobe bridge tun tap',
+            # create bridge and tap device
+            f'[ -e /sys/class/net/{self.test_bridge} ]' +
+            f' || (sudo ip link add {self.test_bridge} type bridge; ' +
+            'true)',
+            f'[ -e /sys/class/net/{self.test_tap} ] || ' +
+            f'(sudo ip tuntap add dev {self.test_tap} mode tap ' +
+            'user $(whoami) multi_queue; true)',
+            # add tap device and physical nic to bridge
+            f'[ /sys/class/net/{self.test_tap}/master ' +
+            f'-ef /sys/class/net/{self.test_bridge} ]' +
+            f' || sudo ip link set {self.test_tap} ' +
+            f'master {self.test_bridge}',
+            f'[ /sys/class/net/{self.test_iface}/master ' +
+            f'-ef /sys/class/net/{self.test_bridge} ]' +
+            f' || sudo ip link set {self.test_iface} ' +
+            f'master {self.test_bridge}',
+            # bring up all interfaces (nic, bridge and tap)
+            f'sudo ip link set {self.test_iface} up',
+            f'sudo ip link set {self.test_bridge} up',
+            f'sudo ip link set {self.test_tap} up',
+        ])
 
     def destroy_test_br_tap(self: 'Host'):
         """
@@ -1125,10 +1827,12 @@ class Host(Server):
         Returns
         -------
         """
-        self.exec(f'sudo ip link delete {self.test_tap} || true')
-        self.exec(f'sudo ip link delete {self.test_bridge} || true')
+        self.exec_batch([
+            f'sudo ip link delete {self.test_tap} || true',
+            f'sudo ip link delete {self.test_bridge} || true',
+        ])
 
-    def setup_test_macvtap(self: 'Host'):
+    def setup_test_macvtap(self: 'Host', mode: str = None):
         """
         Setup the macvtap test interface.
 
@@ -1137,19 +1841,27 @@ class Host(Server):
 
         Parameters
         ----------
+        mode : str
+            The macvtap mode, e.g. 'bridge' or 'passthru'. If not given, the
+            kernel's default (vepa) is used. Passthru hands the whole NIC to
+            the guest, which saves the MAC based switching, but the host can
+            no longer use the NIC. The mode only applies when the macvtap is
+            created, an existing one keeps its mode.
 
         Returns
         -------
         """
-        self.exec('sudo modprobe macvlan')
-        self.exec(f'sudo ip link show {self.test_macvtap} 2>/dev/null' +
-                  f' || sudo ip link add link {self.test_iface}' +
-                  f' name {self.test_macvtap} type macvtap')
-        self.exec(f'sudo ip link set {self.test_macvtap} address ' +
-                  f'{self.guest_test_iface_mac} up')
-        self.exec('sudo chmod 666' +
-                  f' /dev/tap$(cat /sys/class/net/{self.test_macvtap}/ifindex)'
-                  )
+        mode_opt = f' mode {mode}' if mode else ''
+        self.exec_batch([
+            'sudo modprobe macvlan',
+            f'[ -e /sys/class/net/{self.test_macvtap} ]' +
+            f' || sudo ip link add link {self.test_iface}' +
+            f' name {self.test_macvtap} type macvtap{mode_opt}',
+            f'sudo ip link set {self.test_macvtap} address ' +
+            f'{self.guest_test_iface_mac} up',
+            'sudo chmod 666' +
+            f' /dev/tap$(cat /sys/class/net/{self.test_macvtap}/ifindex)',
+        ])
 
     def destroy_test_macvtap(self: 'Host'):
         """
@@ -1163,6 +1875,163 @@ class Host(Server):
         """
         self.exec(f'sudo ip link delete {self.test_macvtap} || true')
 
+    def guest_qemu_spec(self: 'Host',
+                        net_type: str,
+                        machine_type: str,
+                        root_disk: str = None,
+                        debug_qemu: bool = False,
+                        ioregionfd: bool = False,
+                        qemu_build_dir: str = None,
+                        vhost: bool = True,
+                        rx_queue_size: int = 512,
+                        tx_queue_size: int = 512,
+                        smp: int = 4,
+                        mem_mb: int = 4096,
+                        blk_queue_size: int = 128,
+                        cpus: list[int] = None,
+                        hugepages: bool = False,
+                        ) -> QemuSpec:
+        # TODO the settings should come from a Guest object
+        """
+        Get the Qemu command specification for a guest VM.
+
+        Parameters
+        ----------
+        net_type : str
+            Test interface network type
+        machine_type : str
+            Guest machine type
+        root_disk : str
+            Path to the disk file for guest's root partition
+        debug_qemu : bool
+            True if you want to attach GDB to Qemu. The GDB server will
+            be bound to port 1234.
+        ioregionfd : bool
+            True if you want to use the IORegionFD enhanced virtio_net_device
+            for the test interface.
+        qemu_build_dir : str
+            Path to the Qemu build directory. Can be empty if you want to use
+            the installed Qemu.
+        vhost : bool
+            True if you want to use vhost on the test interface.
+        rx_queue_size : int
+            Size of the receive queue for the test interface. Larger queues
+            absorb bursts, but under overload they add queueing latency.
+            Beyond 512 they hardly help the throughput any more.
+        tx_queue_size : int
+            Size of the transmit queue for the test interface. Qemu limits
+            it to 256 unless the backend is vhost-user.
+        smp : int
+            Number of virtual CPUs, which is also the number of queues of
+            the bridged tap test interface.
+        mem_mb : int
+            Guest memory size in MiB.
+        blk_queue_size : int
+            Size of the queue of the guest's root disk.
+        cpus : list[int]
+            Host CPUs to pin Qemu to, with taskset. Its vCPU threads and,
+            on recent kernels, its vhost workers inherit the affinity. Not
+            pinned if not given.
+        hugepages : bool
+            True if you want to back the guest memory with hugepages from
+            /dev/hugepages, which saves TLB misses. Enough free hugepages
+            must be reserved on the host.
+
+        Returns
+        -------
+        QemuSpec
+            The Qemu command specification.
+
+        Raises
+        ------
+        ValueError
+            If a queue size is not a power of two in the range Qemu accepts.
+
+        See Also
+        --------
+        run_guest : Run a guest VM.
+        """
+        # check here, since Qemu would only fail inside its tmux window
+        for name, size, min_size in (('rx_queue_size', rx_queue_size, 256),
+                                     ('tx_queue_size', tx_queue_size, 256),
+                                     ('blk_queue_size', blk_queue_size, 4)):
+            if not min_size <= size <= 1024 or size & (size - 1):
+                raise ValueError(f'{name} must be a power of two between ' +
+                                 f'{min_size} and 1024, not {size}')
+
+        dev_type = 'pci' if machine_type == 'pc' else 'device'
+        ioregionfd_opt = ',use-ioregionfd=true' if ioregionfd else ''
+        vhost_opt = 'on' if vhost else 'off'
+
+        qemu_bin_path = 'qemu-system-x86_64'
+        if qemu_build_dir:
+            qemu_bin_path = path_join(qemu_build_dir, qemu_bin_path)
+        disk_path = self.guest_root_disk_path
+        if root_disk:
+            disk_path = root_disk
+        home = self.gethome()
+
+        spec = QemuSpec(
+            binary=qemu_bin_path,
+            machine=machine_type,
+            smp=smp,
+            mem_mb=mem_mb,
+            mem_path='/dev/hugepages' if hugepages else None,
+            drives=[
+                f'id=root,format=qcow2,file={disk_path},if=none,cache=none',
+            ],
+            fsdevs=[
+                f'local,path={home},security_model=none,id=homefs',
+                'local,path=/nix/store,security_model=none,id=nixstorefs',
+            ],
+            netdevs=[
+                f'tap,vhost=on,id=admin0,ifname={self.admin_tap},' +
+                'script=no,downscript=no',
+            ],
+            devices=[
+                f'virtio-blk-{dev_type},id=rootdisk,drive=root' +
+                f'{ioregionfd_opt},queue-size={blk_queue_size}',
+                f'virtio-9p-{dev_type},mount_tag=home,fsdev=homefs',
+                f'virtio-9p-{dev_type},mount_tag=nixstore,fsdev=nixstorefs',
+                f'virtio-net-{dev_type},id=admif,netdev=admin0,' +
+                f'mac={self.guest_admin_iface_mac}',
+            ],
+            monitor='tcp:127.0.0.1:2345,server,nowait',
+        )
+        if debug_qemu:
+            spec.prefix = ['gdbserver', '0.0.0.0:1234']
+        if cpus:
+            spec.prefix = ['taskset', '-c', ','.join(map(str, cpus)),
+                           *spec.prefix]
+
+        # test interface
+        if net_type == 'brtap':
+            # one queue pair per vCPU
+            queues = spec.smp
+            spec.netdevs.append(
+                f'tap,vhost={vhost_opt},id=admin1,ifname={self.test_tap},' +
+                f'script=no,downscript=no,queues={queues}'
+            )
+            test_mac_opt = f'mac={self.guest_test_iface_mac},mq=on'
+            if dev_type == 'pci':
+                # an MSI-X vector for each rx and tx queue, plus the
+                # config and control vectors
+                test_mac_opt += f',vectors={2 * queues + 2}'
+        else:
+            # the macvtap's tap device is passed to Qemu as fd 3, its MAC
+            # address was set to the guest's in setup_test_macvtap
+            spec.netdevs.append(f'tap,vhost={vhost_opt},id=admin1,fd=3')
+            spec.redirects = ('3<>/dev/tap$(cat ' +
+                              f'/sys/class/net/{self.test_macvtap}/ifindex)')
+            test_mac_opt = f'mac={self.guest_test_iface_mac}'
+        spec.devices.append(
+            f'virtio-net-{dev_type},id=testif,netdev=admin1,{test_mac_opt}' +
+            f'{ioregionfd_opt},rx_queue_size={rx_queue_size},' +
+            f'tx_queue_size={tx_queue_size}'
+        )
+
+        return spec
+
     def run_guest(self: 'Host',
                   net_type: str,
                   machine_type: str,
@@ -1171,8 +2040,13 @@ class Host(Server):
                   ioregionfd: bool = False,
                   qemu_build_dir: str = None,
                   vhost: bool = True,
-                  rx_queue_size: int = 256,
-                  tx_queue_size: int = 256,
+                  rx_queue_size: int = 512,
+                  tx_queue_size: int = 512,
+                  smp: int = 4,
+                  mem_mb: int = 4096,
+                  blk_queue_size: int = 128,
+                  cpus: list[int] = None,
+                  hugepages: bool = False,
                   ) -> None:
         # TODO this function should get a Guest object as argument
         """
@@ -1198,99 +2072,59 @@ class Host(Server):
         vhost : bool
             True if you want to use vhost on the test interface.
         rx_queue_size : int
-            Size of the receive queue for the test interface.
+            Size of the receive queue for the test interface. Larger queues
+            absorb bursts, but under overload they add queueing latency.
+            Beyond 512 they hardly help the throughput any more.
         tx_queue_size : int
-            Size of the transmit queue for the test interface.
+            Size of the transmit queue for the test interface. Qemu limits
+            it to 256 unless the backend is vhost-user.
+        smp : int
+            Number of virtual CPUs, which is also the number of queues of
+            the bridged tap test interface.
+        mem_mb : int
+            Guest memory size in MiB.
+        blk_queue_size : int
+            Size of the queue of the guest's root disk.
+        cpus : list[int]
+            Host CPUs to pin Qemu to, with taskset. Its vCPU threads and,
+            on recent kernels, its vhost workers inherit the affinity. Not
+            pinned if not given.
+        hugepages : bool
+            True if you want to back the guest memory with hugepages from
+            /dev/hugepages, which saves TLB misses. Enough free hugepages
+            must be reserved on the host.
 
         Returns
         -------
+
+        See Also
+        --------
+        guest_qemu_spec : Get the Qemu command specification for a guest VM.
         """
-        # TODO this command should be build by the Guest object
-        # it should take all the settings from the config file
-        # and compile them.
-        dev_type = 'pci' if machine_type == 'pc' else 'device'
-        test_net_config = (
-            f" -netdev tap,vhost={'on' if vhost else 'off'}," +
-            f'id=admin1,ifname={self.test_tap},script=no,' +
-            'downscript=no,queues=4' +
-            f' -device virtio-net-{dev_type},id=testif,' +
-            f'netdev=admin1,mac={self.guest_test_iface_mac},mq=on' +
-            (',use-ioregionfd=true' if ioregionfd else '')
-            + f',rx_queue_size={rx_queue_size},tx_queue_size={tx_queue_size}'
-            # + f',rx_queue_size={rx_queue_size},tx_queue_size={tx_queue_size}'
-            # f' -device virtio-net-{dev_type},id=testif,' +
-            # ' -device rtl8139,id=testif,' +
-            # 'netdev=admin1,mac=52:54:00:fa:00:60,mq=on' +
-        ) if net_type == 'brtap' else (
-            f" -netdev tap,vhost={'on' if vhost else 'off'}," +
-            'id=admin1,fd=3 3<>/dev/tap$(cat ' +
-            f'/sys/class/net/{self.test_macvtap}/ifindex) ' +
-            f' -device virtio-net-{dev_type},id=testif,' +
-            'netdev=admin1,mac=$(cat ' +
-            f'/sys/class/net/{self.test_macvtap}/address)' +
-            (',use-ioregionfd=true' if ioregionfd else '')
-            + f',rx_queue_size={rx_queue_size},tx_queue_size={tx_queue_size}'
-            # + f',rx_queue_size={rx_queue_size},tx_queue_size={tx_queue_size}'
-            # f' -device virtio-net-{dev_type},id=testif,' +
-            # ' -device rtl8139,id=testif,' +
-        )
-        qemu_bin_path = 'qemu-system-x86_64'
-        if qemu_build_dir:
-            qemu_bin_path = path_join(qemu_build_dir, qemu_bin_path)
-        disk_path = self.guest_root_disk_path
-        if root_disk:
-            disk_path = root_disk
-        home = self.gethome()
-        self.tmux_new(
-            'qemu',
-            ('gdbserver 0.0.0.0:1234 ' if debug_qemu else '') +
-            qemu_bin_path +
-            f' -machine {machine_type}' +
-            ' -cpu host' +
-            ' -smp 4' +
-            ' -m 4096' +
-            ' -enable-kvm' +
-            f' -drive id=root,format=qcow2,file={disk_path},'
-            'if=none,cache=none' +
-            f' -device virtio-blk-{dev_type},id=rootdisk,drive=root' +
-            (',use-ioregionfd=true' if ioregionfd else '') +
-            f',queue-size={rx_queue_size}' +
-            # ' -cdrom /home/networkadmin/images/guest_init.iso' +
-            f' -fsdev local,path={home},security_model=none,id=homefs' +
-            f' -device virtio-9p-{dev_type},mount_tag=home,fsdev=homefs' +
-            ' -fsdev local,path=/nix/store,security_model=none,id=nixstorefs' +
-            f' -device virtio-9p-{dev_type},mount_tag=nixstore,' +
-            'fsdev=nixstorefs' +
-            ' -serial stdio' +
-            ' -monitor tcp:127.0.0.1:2345,server,nowait' +
-            f' -netdev tap,vhost=on,id=admin0,ifname={self.admin_tap},' +
-            'script=no,downscript=no' +
-            f' -device virtio-net-{dev_type},id=admif,netdev=admin0,' +
-            f'mac={self.guest_admin_iface_mac}' +
-            test_net_config
-            # +
-            # ' -drive id=test1,format=raw,file=/dev/ssd/test1,if=none,' +
-            # 'cache=none' +
-            # f' -device virtio-blk-{dev_type},id=test1,drive=test1' +
-            # ' -drive id=test2,format=raw,file=/dev/ssd/test2,if=none,' +
-            # 'cache=none' +
-            # f' -device virtio-blk-{dev_type},id=test2,drive=test2'
-            # +
-            # ' --trace virtio_mmio_read --trace virtio_mmio_write' +
-            # ' 2>trace.log'
-            )
+        spec = self.guest_qemu_spec(net_type, machine_type, root_disk,
+                                    debug_qemu, ioregionfd, qemu_build_dir,
+                                    vhost, rx_queue_size, tx_queue_size,
+                                    smp, mem_mb, blk_queue_size, cpus,
+                                    hugepages)
+        self.tmux_new('qemu', spec.to_command())
 
-    def kill_guest(self: 'Host') -> None:
+    def kill_guest(self: 'Host', guest: 'Guest' = None) -> None:
         """
         Kill a guest VM.
 
         Parameters
         ----------
+        guest : Guest
+            The guest that is killed. If given, its SSH master connection,
+            which dies with the guest, is closed as well, so the next guest
+            with the same name does not try to use it.
 
         Returns
         -------
         """
         self.tmux_kill('qemu')
+        if guest:
+            guest.close_ssh_master()
 
     def cleanup_network(self: 'Host') -> None:
         """
@@ -1304,11 +2138,18 @@ class Host(Server):
         """
         # TODO
         # self.release_test_iface()
-        self.stop_xdp_reflector(self.test_iface)
-        self.destroy_test_br_tap()
-        self.destroy_test_macvtap()
 
+        # the same as stop_xdp_reflector, destroy_test_br_tap and
+        # destroy_test_macvtap, but in a single round trip
+        self.exec_batch([
+            f'sudo ip link set {self.test_iface} xdpgeneric off || true',
+            f'sudo ip link delete {self.test_tap} || true',
+            f'sudo ip link delete {self.test_bridge} || true',
+            f'sudo ip link delete {self.test_macvtap} || true',
+        ])
 
+
+@dataclass(slots=True, kw_only=True)
 class Guest(Server):
     """
     Guest class.
@@ -1327,63 +2168,37 @@ class Guest(Server):
     Guest(fqdn='server.test.de')
     """
 
-    def __init__(self: 'Guest',
-                 fqdn: str,
-                 test_iface: str,
-                 test_iface_addr: str,
-                 test_iface_mac: str,
-                 test_iface_driv: str,
-                 moongen_dir: str,
-                 moonprogs_dir: str,
-                 xdp_reflector_dir: str,
-                 ) -> None:
+    def __post_init__(self: 'Guest') -> None:
         """
-        Initialize the Guest class.
+        Post initialization.
+
+        This method is called after the object is created.
 
         Parameters
         ----------
-        fqdn : str
-            The fully qualified domain name of the guest.
-        test_iface : str
-            The name of the test interface.
-        test_iface_addr : str
-            The IP address of the test interface.
-        test_iface_mac : str
-            The MAC address of the test interface.
-        test_iface_driv : str
-            The driver of the test interface.
-        moongen_dir : str
-            The directory of the MoonGen installation.
-        moonprogs_dir : str
-            The directory with the MoonGen Lua programs.
-        xdp_reflector_dir : str
-            The directory of the XDP Reflector installation.
-        localhost : bool
-            True if the host is localhost.
 
         Returns
         -------
-        Guest : The Guest object.
 
         See Also
         --------
-        Server : The Server class.
-        Server.__init__ : Initialize the Server class.
-
-        Examples
-        --------
-        >>> Guest('server.test.de')
-        Guest(fqdn='server.test.de')
+        __init__ : Initialize the object.
         """
-        super().__init__(fqdn, test_iface, test_iface_addr, test_iface_mac,
-                         test_iface_driv, moongen_dir, moonprogs_dir,
-                         xdp_reflector_dir)
+        # zero argument super() does not work in slotted dataclasses
+        Server.__post_init__(self)
 
-    def __post_init__(self: 'Guest') -> None:
+        # Due to the write lock issue with the /nix/store we cannot do
+        # stuff like opening nix shells. So we make sure the guest can
+        # run commands without that, and therefore unset the nixos
+        # attribute.
+        self.nixos = False
+
+    def close(self: 'Guest') -> None:
         """
-        Post initialization.
+        Release the resources held for the guest.
 
-        This method is called after the object is created.
+        The guest's tmux session ends with the VM, which is usually shut
+        down at this point, so only the SSH master connection is closed.
 
         Parameters
         ----------
@@ -1393,17 +2208,12 @@ class Guest(Server):
 
         See Also
         --------
-        __init__ : Initialize the object.
+        Server.close : Release the resources held for the server.
         """
-        super().__post_init__()
-
-        # Due to the write lock issue with the /nix/store we cannot do
-        # stuff like opening nix shells. So we make sure the guest can
-        # run commands without that, and therefore unset the nixos
-        # attribute.
-        self.nixos = False
+        self.close_ssh_master()
 
 
+@dataclass(slots=True, kw_only=True)
 class LoadGen(Server):
     """
     LoadGen class.
@@ -1423,58 +2233,6 @@ class LoadGen(Server):
     LoadGen(fqdn='server.test.de')
     """
 
-    def __init__(self: 'LoadGen',
-                 fqdn: str,
-                 test_iface: str,
-                 test_iface_addr: str,
-                 test_iface_mac: str,
-                 test_iface_driv: str,
-                 moongen_dir: str,
-                 moonprogs_dir: str,
-                 xdp_reflector_dir: str = None,
-                 localhost: bool = False) -> None:
-        """
-        Initialize the LoadGen class.
-
-        Parameters
-        ----------
-        fqdn : str
-            The fully qualified domain name of the load generator.
-        test_iface : str
-            The name of the test interface.
-        test_iface_addr : str
-            The IP address of the test interface.
-        test_iface_mac : str
-            The MAC address of the test interface.
-        test_iface_driv : str
-            The driver of the test interface.
-        moongen_dir : str
-            The directory of the MoonGen installation.
-        moonprogs_dir : str
-            The directory with the MoonGen Lua programs.
-        xdp_reflector_dir : str
-            The directory of the XDP Reflector installation.
-        localhost : bool
-            True if the host is localhost.
-
-        Returns
-        -------
-        LoadGen : The LoadGen object.
-
-        See Also
-        --------
-        Server : The Server class.
-        Server.__init__ : Initialize the Server class.
-
-        Examples
-        --------
-        >>> LoadGen('server.test.de')
-        LoadGen(fqdn='server.test.de')
-        """
-        super().__init__(fqdn, test_iface, test_iface_addr, test_iface_mac,
-                         test_iface_driv, moongen_dir, moonprogs_dir,
-                         xdp_reflector_dir, localhost)
-
     def run_l2_load_latency(self: 'LoadGen',
                             mac: str,
                             rate: int = 10000,
@@ -1511,12 +2269,17 @@ class LoadGen(Server):
         -------
         >>> LoadGen('server.test.de').start_l2_load_latency()
         """
-        self.tmux_new('loadlatency', f'cd {self.moongen_dir}; ' +
-                      'sudo bin/MoonGen '
-                      f'{self.moonprogs_dir}/l2-load-latency.lua ' +
-                      f'-r {rate} -f {histfile} -t {runtime} -s {size} ' +
-                      f'{self._test_iface_id} {mac} ' +
-                      f'2>&1 > {outfile}')
+        self.tmux_new('loadlatency', LOADLATENCY_CMD.format(
+            moongen_dir=self.moongen_dir,
+            moonprogs_dir=self.moonprogs_dir,
+            rate=rate,
+            histfile=histfile,
+            runtime=runtime,
+            size=size,
+            iface_id=self._test_iface_id,
+            mac=mac,
+            outfile=outfile
+        ))
 
     def stop_l2_load_latency(self: 'Server'):
         """